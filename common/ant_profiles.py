@@ -0,0 +1,217 @@
+import struct
+import time
+from ant.core import message, node, constants
+from ant.core.exceptions import ChannelError
+
+
+class ANTProfile:
+    """Master channel broadcasting the data pages of one ANT+ device profile.
+
+    Subclasses set the device type and the channel period (in 1/32768 s) and send one message per period
+    from `update()`, which is called from the transmitter thread. `data` is shared by all profiles and
+    replaced as a whole by the event loop.
+    """
+
+    name = None
+    device_type = None
+    period = None
+
+    def __init__(self, antnode, sensor_id):
+        self.tick = 0
+        self.data = None
+
+        self.antnode = antnode
+        self.channel = antnode.getFreeChannel()
+
+        try:
+            self.channel.name = 'C:%s' % self.name
+            network = node.Network(constants.NETWORK_KEY_ANT_PLUS, 'N:ANT+')
+            self.channel.assign(network, constants.CHANNEL_TYPE_TWOWAY_TRANSMIT)
+            self.channel.setID(self.device_type, sensor_id, 0)
+            self.channel.period = self.period
+            self.channel.frequency = 57
+            self.channel.registerCallback(self)
+        except ChannelError as e:
+            print("Channel config error: " + str(e))
+
+    def open(self):
+        self.channel.open()
+
+    def close(self):
+        self.channel.close()
+
+    def unassign(self):
+        self.channel.unassign()
+
+    def send(self, payload):
+        self.antnode.send(message.ChannelBroadcastDataMessage(self.channel.number, data=payload))
+
+    def update(self):
+        raise NotImplementedError
+
+    def process(self, msg, _):
+        pass
+
+
+class Revolutions:
+    """Crank or wheel revolutions (or heart beats) at a given rate.
+
+    Keeps the number of completed revolutions and the times of the last two, as the ANT+ profiles
+    report events instead of rates.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.fraction = 0.0
+        self.event_time = 0.0
+        self.previous_event_time = 0.0
+        self.timestamp = None
+
+    def add(self, rate, now):
+        # rate in 1/s at the monotonic time now in s
+        if self.timestamp is not None and rate > 0:
+            revolutions = self.fraction + rate * (now - self.timestamp)
+            completed = int(revolutions)
+            if completed > 0:
+                last = now - (revolutions - completed) / rate
+                self.previous_event_time = last - 1 / rate if completed > 1 else self.event_time
+                self.event_time = last
+                self.count += completed
+            self.fraction = revolutions - completed
+        self.timestamp = now
+
+    @staticmethod
+    def event_time_1024(event_time):
+        # unit 1/1024 s, rolls over every 64 s
+        return int(event_time * 1024) & 0xFFFF
+
+
+# common data pages
+MANUFACTURER_PAGE = [0x50, 0xFF, 0xFF, 0x0A, 0xFF, 0x00, 0x24, 0x01]
+PRODUCT_PAGE = [0x51, 0xFF, 0x50, 0x0D, 0x02, 0x00, 0x24, 0x01]
+
+
+# page types of the bicycle power profile
+POWER_ONLY, POWER_MANUFACTURER, POWER_PRODUCT = range(3)
+
+# the common pages are interleaved every 61 messages
+POWER_SCHEDULE = tuple(POWER_ONLY if tick % 61 != 60 else POWER_MANUFACTURER if tick < 61 else POWER_PRODUCT
+                       for tick in range(122))
+
+# event count, pedal power - not used, cadence - unit rpm, accumulated power - unit 1W, instant power - unit 1W
+POWER_ONLY_PAGE = struct.Struct("<BBBHH")
+
+
+class BicyclePower(ANTProfile):
+    name = 'PWR'
+    device_type = 0x0B
+    period = 8182
+
+    def __init__(self, antnode, sensor_id):
+        super().__init__(antnode, sensor_id)
+        self.update_event = 0
+        self.accumulated_power = 0
+
+        self.page_buffers = [bytearray([0x10, 0x00, 0xFF, 0xFF, 0x00, 0x00, 0x00, 0x00]),
+                             bytearray(MANUFACTURER_PAGE), bytearray(PRODUCT_PAGE)]
+
+    def update(self):
+        data = self.data
+        page = POWER_SCHEDULE[self.tick]
+        self.tick = (self.tick + 1) % len(POWER_SCHEDULE)
+
+        if page == POWER_ONLY:
+            self.update_event += 1
+            self.accumulated_power = (self.accumulated_power + data.instant_power) % 65536
+            POWER_ONLY_PAGE.pack_into(self.page_buffers[POWER_ONLY], 1,
+                                      self.update_event % 256, 0xFF, (data.instant_cadence or 0xFF) % 256,
+                                      self.accumulated_power, data.instant_power & 0xFFFF)
+
+        self.send(self.page_buffers[page])
+
+
+# cadence event time, cumulative cadence revolutions, speed event time, cumulative wheel revolutions
+SPEED_CADENCE_PAGE = struct.Struct("<HHHH")
+
+
+class SpeedCadence(ANTProfile):
+    name = 'SPC'
+    device_type = 0x79
+    period = 8086
+
+    # wheel circumference in m, same as the cycle length of the FE-C settings page
+    WHEEL_CIRCUMFERENCE = 2.15
+
+    def __init__(self, antnode, sensor_id):
+        super().__init__(antnode, sensor_id)
+        self.cadence = Revolutions()
+        self.wheel = Revolutions()
+        self.page_buffer = bytearray(8)
+
+    def update(self):
+        data = self.data
+        now = time.monotonic()
+        self.cadence.add(data.instant_cadence / 60, now)
+        self.wheel.add(data.speed / 1000 / self.WHEEL_CIRCUMFERENCE, now)
+
+        SPEED_CADENCE_PAGE.pack_into(self.page_buffer, 0,
+                                     Revolutions.event_time_1024(self.cadence.event_time), self.cadence.count & 0xFFFF,
+                                     Revolutions.event_time_1024(self.wheel.event_time), self.wheel.count & 0xFFFF)
+        self.send(self.page_buffer)
+
+
+# page types of the heart rate profile
+HEART_RATE_BEAT, HEART_RATE_MANUFACTURER, HEART_RATE_PRODUCT = range(3)
+
+# background pages are interleaved every 65 messages
+HEART_RATE_SCHEDULE = tuple(HEART_RATE_BEAT if tick % 65 != 64 else
+                            HEART_RATE_MANUFACTURER if tick < 65 else HEART_RATE_PRODUCT
+                            for tick in range(130))
+
+# manufacturer specific, previous heart beat event time, heart beat event time, heart beat count, heart rate
+HEART_RATE_BEAT_PAGE = struct.Struct("<BHHBB")
+# heart beat event time, heart beat count, heart rate, at the end of every page
+HEART_RATE_EVENT = struct.Struct("<HBB")
+
+
+class HeartRate(ANTProfile):
+    name = 'HRM'
+    device_type = 0x78
+    period = 8070
+
+    def __init__(self, antnode, sensor_id):
+        super().__init__(antnode, sensor_id)
+        self.beats = Revolutions()
+        self.toggle = 0
+
+        self.page_buffers = [bytearray([0x04, 0xFF, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]),
+                             # manufacturer id - development, serial number MSB
+                             bytearray([0x02, 0xFF, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]),
+                             # hardware version, software version, model number
+                             bytearray([0x03, 0x01, 0x01, 0x01, 0x00, 0x00, 0x00, 0x00])]
+
+    def update(self):
+        heart_rate = self.data.instant_heartrate
+        page = HEART_RATE_SCHEDULE[self.tick]
+
+        # the page toggle bit changes every four messages
+        if self.tick % 4 == 0:
+            self.toggle ^= 0x80
+        self.tick = (self.tick + 1) % len(HEART_RATE_SCHEDULE)
+
+        if heart_rate is None:
+            # no heart rate monitor connected
+            return
+
+        self.beats.add(heart_rate / 60, time.monotonic())
+        event_time = Revolutions.event_time_1024(self.beats.event_time)
+
+        buffer = self.page_buffers[page]
+        buffer[0] = (buffer[0] & 0x7F) | self.toggle
+        if page == HEART_RATE_BEAT:
+            HEART_RATE_BEAT_PAGE.pack_into(buffer, 1, 0xFF, Revolutions.event_time_1024(self.beats.previous_event_time),
+                                           event_time, self.beats.count & 0xFF, heart_rate & 0xFF)
+        else:
+            HEART_RATE_EVENT.pack_into(buffer, 4, event_time, self.beats.count & 0xFF, heart_rate & 0xFF)
+
+        self.send(buffer)
@@ -0,0 +1,76 @@
+import threading
+import time
+from common.statistics import MovingStatistics
+
+
+class TransmitStatistics:
+    __slots__ = ('missed', 'jitter')
+
+    def __init__(self):
+        self.missed = 0
+        self.jitter = MovingStatistics()
+
+    def add(self, jitter):
+        self.jitter.add(jitter)
+
+    def to_json(self):
+        return dict(sent=self.jitter.count, missed=self.missed, **self.jitter.to_json('jitter'))
+
+
+class ANTTransmitter(threading.Thread):
+    """Broadcasts the data pages of ANT+ profiles from a dedicated thread.
+
+    Each profile sends one message per channel period (`profile.period` in 1/32768 s) from its `update()`.
+    Deadlines are derived from the start time and the slot number, so late wakeups do not add up. Slots
+    that have already passed when the thread wakes up are skipped and counted as missed.
+    Profiles read their data through a single attribute, which the event loop replaces with a new object
+    instead of changing it in place.
+    """
+
+    CLOCK = 32768
+
+    def __init__(self):
+        super().__init__(name="ANTTransmitter", daemon=True)
+        self.profiles = []
+        self.statistics = dict()
+        self.stopped = threading.Event()
+        self.error = None
+
+    def add(self, name, profile):
+        # profiles have to be added before the thread is started
+        self.profiles.append(profile)
+        self.statistics[name] = TransmitStatistics()
+
+    def stop(self):
+        self.stopped.set()
+
+    def get_statistics(self):
+        return dict([(name, statistics.to_json()) for name, statistics in self.statistics.items()])
+
+    def run(self):
+        start = time.monotonic()
+        periods = [profile.period / self.CLOCK for profile in self.profiles]
+        slots = [0] * len(self.profiles)
+        deadlines = [start] * len(self.profiles)
+        statistics = list(self.statistics.values())
+
+        try:
+            while not self.stopped.is_set():
+                index = min(range(len(deadlines)), key=deadlines.__getitem__)
+
+                delay = deadlines[index] - time.monotonic()
+                if delay > 0 and self.stopped.wait(delay):
+                    return
+
+                now = time.monotonic()
+                self.profiles[index].update()
+                statistics[index].add(now - deadlines[index])
+
+                # next slot, skipping the ones that have passed in the meantime
+                slot = max(slots[index] + 1, int((time.monotonic() - start) / periods[index]) + 1)
+                statistics[index].missed += slot - slots[index] - 1
+                slots[index] = slot
+                deadlines[index] = start + slot * periods[index]
+        except Exception as err:
+            # e.g. ANTException or USB errors, ant_task restarts the node and logs the error
+            self.error = err
@@ -1,9 +1,10 @@
 # Thanks to the original work of
 # https://github.com/dhague/vpower
 
-from ant.core import message, node, constants
-from ant.core.exceptions import ChannelError
+from ant.core import message
 from dataclasses import dataclass
+import struct
+from common.ant_profiles import ANTProfile
 
 @dataclass
 class FitnessEquipmentData:
@@ -15,101 +16,98 @@ class FitnessEquipmentData:
     instant_heartrate: int = None   # unit: 1 bpm
 
 
-class FitnessEquipmentControls:
+# page types
+GENERAL, SETTINGS, STATIONARY_BIKE, VENDOR, PRODUCT = range(5)
+
+# fixed fields of each page type
+PAGE_TEMPLATES = (
+    [0x10, 0x19, 0x00, 0x00, 0x00, 0x00, 0xFF, 0x20],   # general fe data page, equipment type - trainer
+    [0x11, 0xFF, 0xFF, 215, 0xFF, 0x7F, 0x00, 0x20],    # general settings page, cycle length - unit 0.01m,
+                                                        # incline - not supported by bike
+    [0x19, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x20],   # specific stationary bike data
+    [0x50, 0xFF, 0xFF, 0x0A, 0xFF, 0x00, 0x24, 0x01],   # manufacturer's information
+    [0x51, 0xFF, 0x50, 0x0D, 0x02, 0x00, 0x24, 0x01]    # product information
+)
+
+# variable fields of the general and stationary bike pages
+PAGE_GENERAL = struct.Struct("<BBHB")
+PAGE_STATIONARY_BIKE = struct.Struct("<BBHH")
+
+
+def transmission_pattern_c(tick):
+    if tick % 132 in [64, 65]:
+        return VENDOR
+    elif tick % 132 in [130, 131]:
+        return PRODUCT
+    elif tick % 66 % 8 in [3, 6]:
+        return SETTINGS
+    elif tick % 66 % 8 in [2, 7]:
+        return STATIONARY_BIKE
+    return GENERAL
+
+
+# page type of each message, the pattern repeats every 132 messages
+SCHEDULE = tuple(transmission_pattern_c(tick) for tick in range(132))
+
+
+class FitnessEquipmentControls(ANTProfile):
+    name = 'FEC'
+    device_type = 0x11
+    # channel period in 1/32768 s (4 Hz)
+    period = 8192
+
     def __init__(self, antnode, sensor_id, callbacks=None):
-        self.tick = 0
+        super().__init__(antnode, sensor_id)
+
         self.update_event = 0
         self.accumulated_power = 0
 
         self.data = FitnessEquipmentData()
 
-        self.antnode = antnode
-        self.channel = antnode.getFreeChannel()
-
         self.callbacks = callbacks if callbacks is not None else dict()
 
-        try:
-            self.channel.name = 'C:FEC'
-            network = node.Network(constants.NETWORK_KEY_ANT_PLUS, 'N:ANT+')
-            self.channel.assign(network, constants.CHANNEL_TYPE_TWOWAY_TRANSMIT)
-            self.channel.setID(0x11, sensor_id, 0)
-            self.channel.period = 8192
-            self.channel.frequency = 57
-            self.channel.registerCallback(self)
-        except ChannelError as e:
-            print ("Channel config error: "+str(e))
+        self.page_buffers = [bytearray(template) for template in PAGE_TEMPLATES]
+        self.pages = (self.page_general, self.page_settings, self.page_stationary_bike,
+                      self.page_vendor, self.page_product)
 
-    def open(self):
-        self.channel.open()
+    def update(self):
+        # called from the transmitter thread, self.data is replaced as a whole by the event loop
+        data = self.data
 
-    def close(self):
-        self.channel.close()
+        payload = self.pages[SCHEDULE[self.tick]](data)
+        self.tick = (self.tick + 1) % len(SCHEDULE)
 
-    def unassign(self):
-        self.channel.unassign()
+        self.send(payload)
 
-    def update(self):
-        # transmission pattern "C"
-        if self.tick % 132 in [64, 65]:
-            payload = self.page_vendor()
-        elif self.tick % 132 in [130, 131]:
-            payload = self.page_product()
-        elif self.tick % 66 % 8 in [3, 6]:
-            payload = self.page_settings()
-        elif self.tick % 66 % 8 in [2, 7]:
-            payload = self.page_stationary_bike()
-            self.update_event += 1
-        else:
-            payload = self.page_general()
-
-        self.antnode.send(message.ChannelBroadcastDataMessage(self.channel.number, data=bytearray(payload)))
-        self.tick += 1
-
-    def page_general(self):
-        # general data page
-        return [
-            0x10,                                           # general fe data page
-            0x19,                                           # equipment type - trainer
-            self.data.time_elapsed % 256,                   # time elapsed - unit 0.25s
-            0x00,                                           # distance travelled - unit metres - NOT IMPLEMENTED
-            self.data.speed & 0xFF,                         # speed LSB - unit 0.001 m/s
-            self.data.speed >> 8,                           # speed MSB - unit 0.001 m/s
-            (self.data.instant_heartrate or 0xFF) % 256,    # heartrate - unit bpm
-            0x20                                            # capabilities & FE state
-        ]
-
-    def page_settings(self):
-        return [
-            0x11,                                           # general settings page
-            0xFF,                                           # reserved
-            0xFF,                                           # reserved
-            215,                                            # cycle length (wheel circumference) - unit 0.01m
-            0xFF,                                           # incline LSB - not supported by bike
-            0x7F,                                           # incline MSB - not supported by bike
-            self.data.resistance % 256,                     # resistance level
-            0x20                                            # capabilities & FE state
-        ]
-
-    def page_stationary_bike(self):
-        self.accumulated_power += self.data.instant_power
+    # pages are preallocated, only their variable fields are written for each message
+    def page_general(self, data):
+        # time elapsed - unit 0.25s, distance travelled - NOT IMPLEMENTED, speed - unit 0.001 m/s, heartrate - unit bpm
+        PAGE_GENERAL.pack_into(self.page_buffers[GENERAL], 2,
+                               data.time_elapsed % 256, 0x00, data.speed & 0xFFFF,
+                               (data.instant_heartrate or 0xFF) % 256)
+        return self.page_buffers[GENERAL]
+
+    def page_settings(self, data):
+        # resistance level
+        self.page_buffers[SETTINGS][6] = data.resistance % 256
+        return self.page_buffers[SETTINGS]
+
+    def page_stationary_bike(self, data):
+        self.accumulated_power += data.instant_power
         self.accumulated_power %= 65536
 
-        return [
-            0x19,                                           # specific stationary bike data
-            self.update_event % 256,                        # event counter
-            (self.data.instant_cadence or 0xFF) % 256,      # cadence - unit rpm
-            self.accumulated_power & 0xFF,                  # accumulated power LSB - unit 1W
-            self.accumulated_power >> 8,                    # accumulated power MSB - unit 1W
-            self.data.instant_power & 0xFF,                 # instant power LSB - unit 1W
-            (self.data.instant_power >> 8) & 0xF,           # instant power MSN & trainer status
-            0x20                                            # capabilities & FE state
-        ]
-
-    def page_vendor(self):
-        return [0x50, 0xFF, 0xFF, 0x0A, 0xFF, 0x00, 0x24, 0x01]
-
-    def page_product(self):
-        return [0x51, 0xFF, 0x50, 0x0D, 0x02, 0x00, 0x24, 0x01]
+        # event counter, cadence - unit rpm, accumulated power - unit 1W, instant power (12 bit) & trainer status
+        PAGE_STATIONARY_BIKE.pack_into(self.page_buffers[STATIONARY_BIKE], 1,
+                                       self.update_event % 256, (data.instant_cadence or 0xFF) % 256,
+                                       self.accumulated_power, data.instant_power & 0xFFF)
+        self.update_event += 1
+        return self.page_buffers[STATIONARY_BIKE]
+
+    def page_vendor(self, _):
+        return self.page_buffers[VENDOR]
+
+    def page_product(self, _):
+        return self.page_buffers[PRODUCT]
 
     # handle control messages from fitness equipment display
     def process(self, msg, _):
@@ -1,10 +1,9 @@
 import gpxpy
 import gpxpy.gpx
-import math
-import flexpolyline
-import bisect
-from itertools import accumulate
+import dataclasses
 from dataclasses import dataclass
+from common.track import Track
+from common.track_index import TrackIndex, COLUMNS
 
 
 @dataclass
@@ -19,124 +18,51 @@ class GPXTrackOverview:
     polyline: str
 
 
-@dataclass
-class DistanceTrackInfo:
-    latitude: float
-    longitude: float
-    elevation: float
-    grade: float
-    progress: float
+class GPXTrack(Track):
+    gpx = None
 
+    def __init__(self, filename, index_path=None):
+        if index_path is not None:
+            self.index = TrackIndex.load_or_build(filename, index_path, lambda: self.parse(filename))
+            overview, columns = self.index.overview, self.index.columns
+        else:
+            self.index = None
+            overview, *values = self.parse(filename)
+            columns = dict(zip(COLUMNS, values))
 
-class GPXTrack:
-    accumulated_distances = []
-    points = []
+        super().__init__(columns['latitudes'], columns['longitudes'], columns['elevations'],
+                         distances=columns['distances'])
 
-    gpx = None
+        self.info = GPXTrackOverview(**dict(overview, filename=filename))
 
-    def __init__(self, filename):
-        gpx_file = open(filename, 'r', encoding="utf-8")
-        self.gpx = gpxpy.parse(gpx_file)
+    def parse(self, filename):
+        with open(filename, 'r', encoding="utf-8") as gpx_file:
+            self.gpx = gpxpy.parse(gpx_file)
 
-        # pair start and end points for each waypoint-segment
         points = [point for track in self.gpx.tracks for segment in track.segments for point in segment.points]
-        self.points = list(zip(points[:-1], points[1:]))
+        track = Track(latitudes=[point.latitude for point in points],
+                      longitudes=[point.longitude for point in points],
+                      elevations=[point.elevation for point in points])
 
-        # distances
-        distances = [self.distance(start, end) for start, end in self.points]
-
-        # accumulated distances (total distance)
-        self.accumulated_distances = list(accumulate(distances))
-
-        self.info = GPXTrackOverview(
+        overview = GPXTrackOverview(
             filename=filename,
             trackname="\n".join([track.name for track in self.gpx.tracks]),
-            distance=self.accumulated_distances[-1],
-            ascent_m=sum(filter(lambda x: x >= 0, self.ascends_m(self.points))),
-            descend_m=sum(filter(lambda x: x < 0, self.ascends_m(self.points))),
-            max_ascent_percent=max(self.ascends_percent(self.points))*100,
-            max_descend_percent=min(self.ascends_percent(self.points))*100,
-            polyline=self.to_polyline())
+            distance=track.total_distance,
+            ascent_m=track.ascent_m,
+            descend_m=track.descend_m,
+            max_ascent_percent=track.max_ascent_grade*100,
+            max_descend_percent=track.max_descend_grade*100,
+            polyline=track.to_polyline())
+
+        return dataclasses.asdict(overview), track.latitudes, track.longitudes, track.elevations, track.distances
 
     def print_summary(self):
-        print("\n".join([track.name for track in self.gpx.tracks]))
-        print("Total distance: %0.1fm" % self.accumulated_distances[-1])
+        print(self.info.trackname)
+        print("Total distance: %0.1fm" % self.total_distance)
 
     def get_info(self):
         return self.info
 
-    def get_info_at_distance(self, at_distance):
-        dist_index = bisect.bisect_left(self.accumulated_distances, at_distance)
-
-        if dist_index >= len(self.points):
-            dist_index = len(self.points) - 1
-
-        start, end = self.points[dist_index]
-
-        segment_distance = self.distance(start, end)
-        try:
-            grade = (end.elevation - start.elevation) / segment_distance
-        except ZeroDivisionError:
-            grade = 0
-
-        # force progress to [0, 1]
-        segment_progress = max(0, min(1, 1 - (self.accumulated_distances[dist_index] - at_distance) / segment_distance))
-
-        # interpolate coordinates
-        progress_latitude = (1-segment_progress)*start.latitude + segment_progress*end.latitude
-        progress_longitude = (1-segment_progress)*start.longitude + segment_progress*end.longitude
-        progress_elevation = (1 - segment_progress) * start.elevation + segment_progress * end.elevation
-
-        progress = max(0, min(1, at_distance / self.accumulated_distances[-1]))
-
-        return DistanceTrackInfo(progress_latitude, progress_longitude, progress_elevation, grade, progress)
-
-    def get_progress_at_distance(self, at_distance):
-        # force progress to [0, 1]
-        return max(0, min(1, at_distance/self.accumulated_distances[-1]))
-
-    def to_polyline(self):
-        return flexpolyline.encode([(point.latitude, point.longitude, point.elevation) for track in self.gpx.tracks
-                                    for segment in track.segments
-                                    for point in segment.points],
-                                   third_dim=flexpolyline.ALTITUDE,
-                                   precision=6,
-                                   third_dim_precision=2)
-
-    @staticmethod
-    def ascends_m(segments):
-        return [(end.elevation - start.elevation) for start, end in segments]
-
-    @staticmethod
-    def ascends_percent(segments):
-        def get_ascend(start, end):
-            try:
-                return (end.elevation - start.elevation)/GPXTrack.distance(start, end)
-            except ZeroDivisionError:
-                return 0
-
-        return [get_ascend(start, end) for start, end in segments]
-
-    @staticmethod
-    def distance(start, end):
-        return GPXTrack.haversine(coord1=(start.latitude, start.longitude),
-                                  coord2=(end.latitude, end.longitude))
-
-    @staticmethod
-    def haversine(coord1, coord2):
-        R = 6372800  # Earth radius in meters
-        lat1, lon1 = coord1
-        lat2, lon2 = coord2
-
-        phi1, phi2 = math.radians(lat1), math.radians(lat2)
-        dphi = math.radians(lat2 - lat1)
-        dlambda = math.radians(lon2 - lon1)
-
-        a = math.sin(dphi / 2) ** 2 + \
-            math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
-
-        return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
 
 if __name__ == '__main__':
     t = GPXTrack(filename=r'fass.gpx')
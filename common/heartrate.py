@@ -0,0 +1,144 @@
+import collections
+import math
+import struct
+import numpy as np
+
+FLAG_HEART_RATE_UINT16 = 0x01
+FLAG_ENERGY_EXPENDED = 0x08
+FLAG_RR_INTERVALS = 0x10
+
+
+def parse_heart_rate_measurement(data):
+    """Heart rate in bpm and all RR intervals in s of a Heart Rate Measurement (0x2A37) notification.
+
+    Raises ValueError for malformed notifications.
+    """
+    try:
+        flags = data[0]
+        if flags & FLAG_HEART_RATE_UINT16:
+            heart_rate = data[1] | (data[2] << 8)
+            offset = 3
+        else:
+            heart_rate = data[1]
+            offset = 2
+    except IndexError:
+        raise ValueError("Heart rate measurement too short: %s" % bytes(data).hex())
+
+    if flags & FLAG_ENERGY_EXPENDED:
+        offset += 2
+
+    rris = []
+    if flags & FLAG_RR_INTERVALS and len(data) > offset:
+        # RR intervals in 1/1024 s, oldest first
+        count = (len(data) - offset) // 2
+        rris = [round(value / 1024, 3) for value in struct.unpack_from("<%dH" % count, data, offset)]
+    return heart_rate, rris
+
+
+class HRVEngine:
+    """Rolling heart rate variability over the RR intervals of the last `window` seconds.
+
+    RMSSD and SDNN are updated with every beat from running sums, DFA alpha1 is computed on request. Intervals
+    outside of 300-2000 ms or differing more than `artifact_threshold` from the previous beat are counted as
+    artifacts and not used, successive differences are only taken between consecutive valid beats.
+    """
+
+    def __init__(self, window=120, min_beats=50, artifact_threshold=0.2):
+        self.window = window * 1000
+        self.min_beats = min_beats
+        self.artifact_threshold = artifact_threshold
+        self.reset()
+
+    def reset(self):
+        # RR intervals in ms, and whether the difference to the previous interval is valid
+        self.beats = collections.deque()
+        self.duration = 0
+        self.sum = 0
+        self.sum_squares = 0
+        self.differences = 0
+        self.sum_differences = 0
+
+        self.last = None
+        self.artifacts = 0
+
+    def add(self, rri):
+        rri = int(round(rri * 1000))
+        if not 300 <= rri <= 2000 or (self.last is not None and
+                                      abs(rri - self.last) > self.artifact_threshold * self.last):
+            self.artifacts += 1
+            self.last = None
+            return
+
+        difference = None if self.last is None else rri - self.last
+        self.last = rri
+
+        self.beats.append((rri, difference))
+        self.duration += rri
+        self.sum += rri
+        self.sum_squares += rri * rri
+        if difference is not None:
+            self.differences += 1
+            self.sum_differences += difference * difference
+
+        while self.duration > self.window:
+            old, old_difference = self.beats.popleft()
+            self.duration -= old
+            self.sum -= old
+            self.sum_squares -= old * old
+            if old_difference is not None:
+                self.differences -= 1
+                self.sum_differences -= old_difference * old_difference
+
+            # the difference of the next beat refers to the removed one
+            if len(self.beats):
+                rri, difference = self.beats[0]
+                if difference is not None:
+                    self.differences -= 1
+                    self.sum_differences -= difference * difference
+                    self.beats[0] = (rri, None)
+
+    @property
+    def rmssd(self):
+        if self.differences < self.min_beats:
+            return None
+        return math.sqrt(self.sum_differences / self.differences)
+
+    @property
+    def sdnn(self):
+        count = len(self.beats)
+        if count < self.min_beats:
+            return None
+        return math.sqrt(max(0, (self.sum_squares - self.sum * self.sum / count) / (count - 1)))
+
+    def alpha1(self, scales=range(4, 17)):
+        """Short term scaling exponent of detrended fluctuation analysis."""
+        if len(self.beats) < max(self.min_beats, 2 * scales[-1]):
+            return None
+
+        rris = np.array([rri for rri, _ in self.beats], dtype=np.float64)
+        profile = np.cumsum(rris - rris.mean())
+
+        fluctuations = []
+        for scale in scales:
+            # linear detrending of each window of the integrated series
+            segments = profile[:len(profile) // scale * scale].reshape(-1, scale)
+            x = np.arange(scale) - (scale - 1) / 2
+            centered = segments - segments.mean(axis=1, keepdims=True)
+            slopes = centered @ x / (x @ x)
+            residuals = centered - slopes[:, None] * x
+            fluctuations.append(math.sqrt(np.mean(residuals ** 2)))
+
+        fluctuations = np.array(fluctuations)
+        if np.any(fluctuations <= 0):
+            return None
+        return float(np.polyfit(np.log(np.array(scales)), np.log(fluctuations), 1)[0])
+
+    def get_info(self):
+        rmssd = self.rmssd
+        sdnn = self.sdnn
+        alpha1 = self.alpha1()
+        return {'rmssd': None if rmssd is None else round(rmssd, 1),
+                'sdnn': None if sdnn is None else round(sdnn, 1),
+                'alpha1': None if alpha1 is None else round(alpha1, 3),
+                'beats': len(self.beats),
+                'artifacts': self.artifacts}
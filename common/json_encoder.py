@@ -5,4 +5,6 @@ class EnhancedJSONEncoder(json.JSONEncoder):
     def default(self, o):
         if dataclasses.is_dataclass(o):
             return dataclasses.asdict(o)
+        if hasattr(o, "to_json"):
+            return o.to_json()
         return super().default(o)
\ No newline at end of file
@@ -1,9 +1,148 @@
+import asyncio
 import serial
 import aioserial
+import time
+from common.statistics import MovingStatistics
+
+
+class KettlerStatus:
+    """Status of the bike as published on kettler/data."""
+
+    # attribute and payload key of each field
+    FIELDS = (('cadence', 'cadence'),
+              ('speed', 'speed'),
+              ('distance', 'distance'),
+              ('dest_power', 'destPower'),
+              ('energy', 'energy'),
+              ('time_elapsed', 'timeElapsed'),
+              ('real_power', 'realPower'),
+              ('calc_distance', 'calcDistance'))
+
+    __slots__ = tuple(attribute for attribute, _ in FIELDS)
+
+    def __init__(self, cadence=0, speed=0.0, distance=0.0, dest_power=0, energy=0, time_elapsed="00:00",
+                 real_power=0, calc_distance=0.0):
+        self.cadence = cadence
+        self.speed = speed
+        self.distance = distance
+        self.dest_power = dest_power
+        self.energy = energy
+        self.time_elapsed = time_elapsed
+        self.real_power = real_power
+        self.calc_distance = calc_distance
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(*[payload[key] for _, key in cls.FIELDS])
+
+    @classmethod
+    def from_bytes(cls, status_line):
+        """Parse a status line as read from the serial port, returns None if it is malformed."""
+        # heartRate cadence speed distanceInFunnyUnits destPower energy timeElapsed realPower
+        # 000 052 095 000 030 0001 00:12 030
+        segments = status_line.split()
+        if len(segments) != 8:
+            return None
+
+        try:
+            # int() and float() parse bytes directly, only the elapsed time is kept as a string
+            return cls(int(segments[1]), float(segments[2]) / 10, int(segments[3]) / 10, int(segments[4]),
+                       int(segments[5]), segments[6].decode("ascii"), int(segments[7]))
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    def to_json(self):
+        return dict([(key, getattr(self, attribute)) for attribute, key in self.FIELDS])
+
+    def __eq__(self, other):
+        if not isinstance(other, KettlerStatus):
+            return NotImplemented
+        # stops at the first changed field
+        for attribute in self.__slots__:
+            if getattr(self, attribute) != getattr(other, attribute):
+                return False
+        return True
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "KettlerStatus(%s)" % ", ".join("%s=%r" % (attribute, getattr(self, attribute))
+                                               for attribute, _ in self.FIELDS)
+
+
+class CommandStatistics:
+    __slots__ = ('timeouts', 'mismatches', 'latency')
+
+    def __init__(self):
+        self.timeouts = 0
+        self.mismatches = 0
+        self.latency = MovingStatistics()
+
+    def add(self, latency):
+        self.latency.add(latency)
+
+    def to_json(self):
+        return dict(count=self.latency.count, timeouts=self.timeouts, mismatches=self.mismatches,
+                    **self.latency.to_json('latency'))
+
+
+class PowerControl:
+    """Decides which command to send to the bike next.
+
+    The target power is only sent with PW when it changes or the bike does not confirm it; otherwise the
+    bike is polled with ST. The bike is put back into remote control mode (CM) only after several
+    consecutive mismatches and not more often than every `mode_change_cooldown` seconds.
+    """
+
+    def __init__(self, mode_change_after=3, mode_change_cooldown=5):
+        self.mode_change_after = mode_change_after
+        self.mode_change_cooldown = mode_change_cooldown
+
+        self.sent_power = None
+        self.confirmed = False
+        self.mismatches = 0
+        self.last_mode_change = None
+
+    def needs_power(self, power):
+        return power != self.sent_power or not self.confirmed
+
+    def sent(self, power):
+        self.sent_power = power
+
+    def needs_mode_change(self, dest_power):
+        """Check the power the bike reports and return whether the mode has to be changed."""
+        if dest_power == self.sent_power:
+            self.confirmed = True
+            self.mismatches = 0
+            return False
+
+        # send the power again with the next command
+        self.confirmed = False
+        self.mismatches += 1
+
+        now = time.monotonic()
+        if self.mismatches >= self.mode_change_after and \
+                (self.last_mode_change is None or now - self.last_mode_change >= self.mode_change_cooldown):
+            self.mismatches = 0
+            self.last_mode_change = now
+            return True
+
+        return False
 
 
 class Kettler:
-    def __init__(self, serial_port):
+    """Serial protocol engine for the Kettler bike.
+
+    Commands are queued and written one at a time by a worker task, which matches each response to its
+    command and measures the round-trip latency. The pause between a response and the next command adapts
+    to the bike: it grows when responses time out or do not match, and while the bike answers it shrinks
+    towards `latency_factor` times the measured latency of the command.
+    """
+
+    # commands answered with a status line
+    STATUS_COMMANDS = ("ST", "PW")
+
+    def __init__(self, serial_port, min_gap=0.02, max_gap=0.5, latency_factor=0.5):
         self.serial_port = aioserial.AioSerial(serial_port, baudrate=9600, parity=serial.PARITY_NONE, timeout=1)
         self.CHANGE_MODE = "CM\r\n"
         self.GET_ID = "ID\r\n"
@@ -11,15 +150,104 @@ class Kettler:
         self.SET_POWER = "PW %d\r\n"
         self.RESET = "RS\r\n"
 
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.latency_factor = latency_factor
+        self.gap = min_gap
+        self.last_response = 0
+
+        self.commands = asyncio.Queue()
+        self.worker = None
+        self.statistics = dict()
+
     async def close(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+
+        # fail commands that have not been sent
+        while not self.commands.empty():
+            _, future = self.commands.get_nowait()
+            if not future.done():
+                future.set_exception(IOError("Serial port closed"))
+
         self.serial_port.close()
 
     async def rpc(self, message):
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self.command_task())
+
+        future = asyncio.get_running_loop().create_future()
+        await self.commands.put((message, future))
+        return await future
+
+    async def command_task(self):
+        while True:
+            message, future = await self.commands.get()
+            if future.done():
+                # caller has been cancelled
+                continue
+
+            try:
+                response = await self.send(message)
+            except Exception as e:
+                # the caller handles the error, the worker goes on with the next command
+                if not future.done():
+                    future.set_exception(e)
+                continue
+
+            if not future.done():
+                future.set_result(response)
+
+    async def send(self, message):
+        command = message.split(maxsplit=1)[0]
+        statistics = self.statistics.get(command)
+        if statistics is None:
+            statistics = self.statistics[command] = CommandStatistics()
+
+        # pace commands, the bike drops commands that arrive too fast
+        delay = self.last_response + self.gap - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        sent = time.monotonic()
         await self.serial_port.write_async(message.encode("utf-8"))
-        self.serial_port.flush()
-        response = (await self.serial_port.readline_async()).rstrip()  # rstrip trims trailing whitespace
+
+        # skip stale responses to earlier commands
+        for _ in range(2):
+            response = (await self.serial_port.readline_async()).rstrip()  # rstrip trims trailing whitespace
+            self.last_response = time.monotonic()
+
+            if len(response) == 0:
+                statistics.timeouts += 1
+                self.gap = min(self.max_gap, self.gap * 2)
+                return response
+
+            if self.matches(command, response):
+                statistics.add(self.last_response - sent)
+                # a slow bike needs more time to process the next command
+                self.gap = min(self.max_gap, max(self.min_gap, self.gap * 0.9,
+                                                 self.latency_factor * statistics.latency.average))
+                return response
+
+            statistics.mismatches += 1
+            self.gap = min(self.max_gap, self.gap * 2)
+
         return response
 
+    def matches(self, command, response):
+        if command in self.STATUS_COMMANDS:
+            return len(response.split()) == 8
+        return True
+
+    def get_statistics(self):
+        return dict([(command, statistics.to_json()) for command, statistics in self.statistics.items()],
+                    gap=self.gap)
+
     async def changeMode(self):
         # put the bike in remote control mode
         return (await self.rpc(self.CHANGE_MODE)).decode("utf-8")
@@ -32,37 +260,14 @@ class Kettler:
         return (await self.rpc(self.GET_ID)).decode("utf-8")
 
     async def setPower(self, power):
-        try:
-            status_line = (await self.rpc(self.SET_POWER % power)).decode("utf-8")
-            return self.decode_status(status_line)
-        except UnicodeDecodeError:
-            return None
+        return self.decode_status(await self.rpc(self.SET_POWER % power))
 
     async def readStatus(self):
-        try:
-            status_line = (await self.rpc(self.GET_STATUS)).decode("utf-8")
-            return self.decode_status(status_line)
-        except UnicodeDecodeError:
-            return None
+        return self.decode_status(await self.rpc(self.GET_STATUS))
 
     @staticmethod
     def decode_status(status_line):
-        # heartRate cadence speed distanceInFunnyUnits destPower energy timeElapsed realPower
-        # 000 052 095 000 030 0001 00:12 030
-        segments = status_line.split()
-
-        if len(segments) == 8:
-            result = {
-                # 'pulse': int(segments[0]),
-                'cadence': int(segments[1]),
-                'speed': float(segments[2]) / 10,
-                'distance': int(segments[3]) / 10,
-                'destPower': int(segments[4]),
-                'energy': int(segments[5]),
-                'timeElapsed': segments[6],
-                'realPower': int(segments[7]),
-            }
-            return result
-        else:
-            print("Received bad status string from Kettler: [%s]" % status_line)
-            return None
+        status = KettlerStatus.from_bytes(status_line)
+        if status is None:
+            print("Received bad status string from Kettler: [%s]" % status_line.decode("ascii", errors="replace"))
+        return status
@@ -0,0 +1,104 @@
+import json
+import os
+import re
+import shutil
+import time
+
+
+class CacheMiss(KeyError):
+    pass
+
+
+class KomootCache:
+    """Disk cache for Komoot API responses.
+
+    Responses are stored per key (e.g. a tour id) in their own directory. Entries younger than `max_age`
+    are fresh and can be served without network access, older entries should be revalidated with the
+    headers from `validators()`. In `offline` mode every cached entry is fresh.
+    The least recently used keys are evicted once the cache grows beyond `max_size` bytes.
+    """
+
+    def __init__(self, path, max_size=100 * 1024 * 1024, max_age=24 * 3600, offline=False):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.offline = offline
+
+    def key_path(self, key):
+        return os.path.join(self.path, re.sub(r'[^A-Za-z0-9_.-]', '_', str(key)))
+
+    def entry_path(self, key, resource):
+        return os.path.join(self.key_path(key), "%s.json" % resource)
+
+    def load(self, key, resource):
+        try:
+            with open(self.entry_path(key, resource), 'r', encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            if self.offline:
+                raise CacheMiss(f"{key}/{resource} is not cached")
+            return None
+
+        # the modification time of a key directory tracks its last use
+        try:
+            os.utime(self.key_path(key))
+        except OSError:
+            pass
+        return entry
+
+    def is_fresh(self, entry):
+        return self.offline or time.time() - entry['fetched'] < self.max_age
+
+    @staticmethod
+    def validators(entry):
+        headers = dict()
+        if entry is not None and entry.get('etag') is not None:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry.get('last_modified') is not None:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, key, resource, url, data, etag=None, last_modified=None):
+        self.write(key, resource, {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched': time.time(),
+            'data': data
+        })
+
+    def refresh(self, key, resource, entry):
+        # the cached entry has been revalidated
+        entry['fetched'] = time.time()
+        self.write(key, resource, entry)
+
+    def write(self, key, resource, entry):
+        # the cache directory is created on the first write, without it entries are just not cached
+        try:
+            os.makedirs(self.key_path(key), exist_ok=True)
+
+            filename = self.entry_path(key, resource)
+            with open(filename + ".tmp", 'w', encoding="utf-8") as f:
+                json.dump(entry, f, separators=(',', ':'))
+            os.replace(filename + ".tmp", filename)
+
+            self.evict()
+        except OSError as e:
+            print(f"[Komoot] Could not cache {key}/{resource}: {str(e)}")
+
+    def size(self, key):
+        key_path = self.key_path(key)
+        return sum(os.path.getsize(os.path.join(key_path, f)) for f in os.listdir(key_path))
+
+    def evict(self):
+        keys = [(os.path.getmtime(self.key_path(key)), self.size(key), key) for key in os.listdir(self.path)]
+        total_size = sum(size for _, size, _ in keys)
+
+        # least recently used first, never evict the most recent key
+        for _, size, key in sorted(keys)[:-1]:
+            if total_size <= self.max_size:
+                break
+
+            print(f"[Komoot] Evicting {key} from cache")
+            shutil.rmtree(self.key_path(key), ignore_errors=True)
+            total_size -= size
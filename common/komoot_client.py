@@ -0,0 +1,90 @@
+import asyncio
+import aiohttp
+from common.komoot_reader import KomootTour
+
+
+class KomootClient:
+    """Non-blocking Komoot API client.
+
+    Uses one pooled aiohttp session for all requests, serves responses from a `KomootCache` and retries
+    failed requests with exponential backoff.
+    """
+
+    def __init__(self, cache, api_url='https://api.komoot.de/v007', web_api_url='https://www.komoot.com/api/v007',
+                 timeout=10, retries=3, backoff=1):
+        self.cache = cache
+        self.api_url = api_url
+        self.web_api_url = web_api_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = None
+
+    def get_session(self):
+        # the session has to be created from within the event loop
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                                 connector=aiohttp.TCPConnector(limit=4))
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def fetch(self, url, headers):
+        for retry in range(self.retries + 1):
+            try:
+                async with self.get_session().get(url, headers=headers) as response:
+                    if response.status == 304:
+                        return response.status, response.headers, None
+
+                    response.raise_for_status()
+                    return response.status, response.headers, await response.json(content_type=None)
+            except aiohttp.ClientResponseError as e:
+                # do not retry client errors
+                if e.status < 500 or retry == self.retries:
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if retry == self.retries:
+                    raise
+
+            await asyncio.sleep(self.backoff * 2 ** retry)
+
+    async def get(self, key, resource, url):
+        loop = asyncio.get_running_loop()
+
+        entry = await loop.run_in_executor(None, self.cache.load, key, resource)
+        if entry is not None and self.cache.is_fresh(entry):
+            return entry['data']
+
+        try:
+            status, headers, data = await self.fetch(url, self.cache.validators(entry))
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            if entry is None:
+                raise
+            print(f"[Komoot] Could not refresh {key}/{resource}, using cached data: {str(e)}")
+            return entry['data']
+
+        if status == 304 and entry is not None:
+            await loop.run_in_executor(None, self.cache.refresh, key, resource, entry)
+            return entry['data']
+
+        await loop.run_in_executor(None, self.cache.store, key, resource, url, data,
+                                   headers.get('ETag'), headers.get('Last-Modified'))
+        return data
+
+    async def get_tour(self, tour_id):
+        # fetch tour info, coordinates and highlights concurrently
+        d_tour, d_cord, d_tl = await asyncio.gather(
+            self.get(tour_id, 'tour', '%s/%s' % (self.api_url, tour_id)),
+            self.get(tour_id, 'coordinates', '%s/%s/coordinates/' % (self.api_url, tour_id)),
+            self.get(tour_id, 'timeline', '%s/%s/timeline/' % (self.api_url, tour_id)))
+
+        # building the tour (e.g. encoding the polyline) takes a while for long tours
+        return await asyncio.get_running_loop().run_in_executor(None, KomootTour, tour_id, d_tour, d_cord, d_tl)
+
+    async def get_tours(self, user_id):
+        d_tour = await self.get('users_%d' % user_id, 'tours',
+                                '%s/users/%d/tours/?type=tour_planned&status=public' % (self.web_api_url, user_id))
+        return KomootTour.tours(d_tour)
@@ -1,21 +1,5 @@
-import gpxpy
-import gpxpy.gpx
-import math
-import flexpolyline
 import bisect
-from itertools import accumulate
-import requests
-from dataclasses import dataclass
-import time
-
-
-@dataclass
-class DistanceTrackInfo:
-    latitude: float
-    longitude: float
-    elevation: float
-    grade: float
-    progress: float
+from common.track import Track
 
 
 class JSONEntity:
@@ -59,31 +43,19 @@ class Creator(JSONEntity):
         pass
 
 
-class KomootTour:
-    accumulated_distances = []
-    points = []
-
-    gpx = None
+class KomootTour(Track):
+    # distance after a highlight in which it is shown in m
+    HIGHLIGHT_RANGE = 500
 
-    def __init__(self, tour_id):
+    def __init__(self, tour_id, d_tour, d_cord, d_tl):
+        # tour info, coordinates and timeline as returned by the Komoot API, see KomootClient.get_tour()
         self.tour_id = tour_id
 
-        # get tour info
-        r_tour = requests.get('https://api.komoot.de/v007/%s' % tour_id)
-        d_tour = r_tour.json()
-
-        # get coordinates
-        r_cord = requests.get('https://api.komoot.de/v007/%s/coordinates/' % tour_id)
-        d_cord = r_cord.json()
-
-        self.coordinates = [gpxpy.gpx.GPXTrackPoint(latitude=point['lat'],
-                                                    longitude=point['lng'],
-                                                    elevation=point['alt']) for point in d_cord['items']]
-
-        # get highlights
-        r_tl = requests.get('https://api.komoot.de/v007/%s/timeline/' % tour_id)
-        d_tl = r_tl.json()
+        super().__init__(latitudes=[point['lat'] for point in d_cord['items']],
+                         longitudes=[point['lng'] for point in d_cord['items']],
+                         elevations=[point['alt'] for point in d_cord['items']])
 
+        # highlights
         def format_highlight(highlight):
             try:
                 return Highlight(name=highlight['name'],
@@ -104,149 +76,68 @@ class KomootTour:
             except KeyError:
                 return None
 
-        self.highlights = dict([(entry['index'], format_highlight(entry['_embedded']['reference']))
-                                for entry in d_tl['_embedded']['items']
-                                if entry['type'] == "highlight"
-                                and format_highlight(entry['_embedded']['reference']) is not None])
+        highlights = [(entry['index'], format_highlight(entry['_embedded']['reference']))
+                      for entry in d_tl['_embedded']['items']
+                      if entry['type'] == "highlight"]
+        self.highlights = dict([(hl_idx, highlight) for hl_idx, highlight in highlights if highlight is not None])
 
-        # pair start and end points for each waypoint-segment
-        self.points = list(zip(self.coordinates[:-1], self.coordinates[1:]))
-
-        # add final track segment
-        self.points.append((self.coordinates[-1], self.coordinates[-1]))
-
-        # distances
-        distances = [self.distance(start, end) for start, end in self.points]
-
-        # accumulated distances (total distance)
-        self.accumulated_distances = list(accumulate(distances))
+        # distance ranges in which the highlights are shown, sorted by start distance
+        hl_indices = sorted(self.highlights.keys(), key=lambda hl_idx: self.distances[hl_idx])
+        self.highlight_starts = [float(self.distances[hl_idx]) for hl_idx in hl_indices]
+        self.highlight_ends = [start + self.HIGHLIGHT_RANGE for start in self.highlight_starts]
+        self.highlight_list = [self.highlights[hl_idx] for hl_idx in hl_indices]
 
         self.info = {
             'name': d_tour['name'],
-            'distance': self.accumulated_distances[-1],
-            'ascent_m': sum(filter(lambda x: x >= 0, self.ascends_m(self.points))),
-            'descend_m': sum(filter(lambda x: x < 0, self.ascends_m(self.points))),
-            'ascent_%': max(self.ascends_percent(self.points))*100,
-            'descend_%': min(self.ascends_percent(self.points))*100,
+            'distance': self.total_distance,
+            'ascent_m': self.ascent_m,
+            'descend_m': self.descend_m,
+            'ascent_%': self.max_ascent_grade*100,
+            'descend_%': self.max_descend_grade*100,
             'polyline': self.to_polyline(),
-            'highlights': [self.accumulated_distances[hl_idx] for hl_idx in self.highlights.keys()]
+            'highlights': self.highlight_starts
         }
 
     def print_summary(self):
         print(self.info['name'])
-        print("Total distance: %0.1fm" % self.accumulated_distances[-1])
+        print("Total distance: %0.1fm" % self.total_distance)
 
     def get_info(self):
         return self.info
 
-    def get_info_at_distance(self, at_distance):
-        dist_index = bisect.bisect_left(self.accumulated_distances, at_distance)
-
-        if dist_index >= len(self.points):
-            dist_index = len(self.points) - 1
-
-        start, end = self.points[dist_index]
-
-        segment_distance = self.distance(start, end)
-        try:
-            grade = (end.elevation - start.elevation) / segment_distance
-        except ZeroDivisionError:
-            grade = 0
-
-        # force progress to [0, 1]
-        try:
-            segment_progress = max(0, min(1, 1 - (self.accumulated_distances[dist_index] - at_distance) / segment_distance))
-        except ZeroDivisionError:
-            segment_progress = 1
-
-        # interpolate coordinates
-        progress_latitude = (1-segment_progress)*start.latitude + segment_progress*end.latitude
-        progress_longitude = (1-segment_progress)*start.longitude + segment_progress*end.longitude
-        progress_elevation = (1-segment_progress)*start.elevation + segment_progress*end.elevation
-
-        progress = max(0, min(1, at_distance / self.accumulated_distances[-1]))
-
-        return DistanceTrackInfo(progress_latitude, progress_longitude, progress_elevation, grade, progress)
-
     def get_highlight_at_distance(self, at_distance):
-        dist_index = bisect.bisect_left(self.accumulated_distances, at_distance)
-
-        if dist_index >= len(self.points):
-            dist_index = len(self.points) - 1
-
         # find the last highlight we passed
-        hl_indices = list(self.highlights.keys())
-        hl_index = hl_indices[bisect.bisect_right(hl_indices, dist_index) - 1]
+        index = bisect.bisect_right(self.highlight_starts, at_distance) - 1
 
-        # if we are within 500m of the highlight return it
-        if hl_index <= dist_index and self.accumulated_distances[dist_index] - self.accumulated_distances[hl_index] <= 500:
-            return self.highlights[hl_index]
+        # if we are within HIGHLIGHT_RANGE of the highlight return it
+        if index >= 0 and at_distance <= self.highlight_ends[index]:
+            return self.highlight_list[index]
         else:
             return None
 
-    def get_progress_at_distance(self, at_distance):
-        # force progress to [0, 1]
-        return max(0, min(1, at_distance/self.accumulated_distances[-1]))
-
-    def to_polyline(self):
-        return flexpolyline.encode([(point.latitude, point.longitude, point.elevation) for point in self.coordinates],
-                                   third_dim=flexpolyline.ALTITUDE, precision=6, third_dim_precision=2)
-
-    @staticmethod
-    def ascends_m(segments):
-        return [(end.elevation - start.elevation) for start, end in segments]
-
-    @staticmethod
-    def ascends_percent(segments):
-        def get_ascend(start, end):
-            try:
-                return (end.elevation - start.elevation)/KomootTour.distance(start, end)
-            except ZeroDivisionError:
-                return 0
-
-        return [get_ascend(start, end) for start, end in segments]
-
-    @staticmethod
-    def distance(start, end):
-        return KomootTour.haversine(coord1=(start.latitude, start.longitude),
-                                    coord2=(end.latitude, end.longitude))
-
     @staticmethod
-    def haversine(coord1, coord2):
-        R = 6372800  # Earth radius in meters
-        lat1, lon1 = coord1
-        lat2, lon2 = coord2
-
-        phi1, phi2 = math.radians(lat1), math.radians(lat2)
-        dphi = math.radians(lat2 - lat1)
-        dlambda = math.radians(lon2 - lon1)
-
-        a = math.sin(dphi / 2) ** 2 + \
-            math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
-
-        return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-    @staticmethod
-    def getTours(user_id):
-        for _ in range(5):
-            try:
-                r_tour = requests.get('https://www.komoot.com/api/v007/users/%d/tours/?type=tour_planned&status=public' % user_id)
-                break
-            except requests.exceptions.RequestException:
-                time.sleep(10)
-                pass
-        d_tour = r_tour.json()
-
+    def tours(d_tour):
         tours = []
         for t in d_tour['_embedded']['tours']:
-            tid = t['_links']['self']['href'].replace("http://api.komoot.de/v007/", "")
+            tid = t['_links']['self']['href'].split("/v007/", 1)[-1]
             tours.append({'name': t['name'], 'tour_id': tid, 'distance': t['distance']})
 
         return tours
 
 
 if __name__ == '__main__':
-    t = KomootTour(tour_id='smart_tours/95408')
+    import asyncio
+    from common.komoot_cache import KomootCache
+    from common.komoot_client import KomootClient
+
+    async def load_tour():
+        client = KomootClient(cache=KomootCache(path='komoot_cache'))
+        try:
+            return await client.get_tour('smart_tours/95408')
+        finally:
+            await client.close()
+
+    t = asyncio.run(load_tour())
     print(t.accumulated_distances[0:3])
     print(t.accumulated_distances[-1])
 
@@ -0,0 +1,238 @@
+import json
+import mmap
+import os
+import struct
+import numpy as np
+
+# magic, version, columns length
+HEADER = struct.Struct("<4sHxxI")
+MAGIC = b"K2LS"
+VERSION = 1
+
+# magic, row count, min/max timestamp, min/max distance
+CHUNK = struct.Struct("<4sIdddd")
+CHUNK_MAGIC = b"K2CK"
+
+# index entries (chunk offset, row count, min/max timestamp, min/max distance), written when the session closes
+INDEX_ENTRY = struct.Struct("<QIdddd")
+# index offset, chunk count, magic
+TRAILER = struct.Struct("<QI4s")
+TRAILER_MAGIC = b"K2IX"
+
+# column types of the log record fields, missing values are stored as NaN or -1
+COLUMNS = (('timestamp', '<f8'), ('speed', '<f4'), ('cadence', '<i2'), ('power', '<i2'), ('distance', '<f8'),
+           ('position_lat', '<f8'), ('position_long', '<f8'), ('altitude', '<f4'), ('grade', '<f4'),
+           ('heart_rate', '<i2'), ('rri', '<f4'))
+
+
+def aligned(length):
+    return (length + 7) & ~7
+
+
+def min_max(values):
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return float('nan'), float('nan')
+    return float(values.min()), float(values.max())
+
+
+class ColumnarSink:
+    """Writes records to a chunked columnar session file.
+
+    The file starts with the column names and types, followed by chunks of up to `chunk_size` rows. Each chunk
+    stores its columns as packed arrays behind a header with the min/max timestamp and distance of its rows.
+    When the session is closed, an index of all chunks is appended, see `SessionReader`.
+    Rows of an incomplete chunk are written as a tail chunk when the file is synced. The tail chunk is
+    replaced by the next chunk, so chunks keep their size however often the file is synced.
+    """
+
+    extension = ".k2s"
+
+    def __init__(self, filename, columns=COLUMNS, chunk_size=1024):
+        self.filename = filename
+        self.part_filename = filename + ".part"
+        self.columns = columns
+        self.chunk_size = chunk_size
+
+        self.pending = []
+        self.index = []
+        # offset of the incomplete last chunk, its rows are still pending
+        self.tail_offset = None
+
+        self.handle = open(self.part_filename, "wb")
+        self.handle.write(self.header(columns))
+
+    @staticmethod
+    def header(columns):
+        columns_data = json.dumps(columns).encode("utf-8")
+        data = HEADER.pack(MAGIC, VERSION, len(columns_data)) + columns_data
+        return data + b"\0" * (aligned(len(data)) - len(data))
+
+    def write(self, records):
+        self.pending.extend(record.values() for record in records)
+        while len(self.pending) >= self.chunk_size:
+            self.write_pending()
+
+    def write_pending(self):
+        self.remove_tail()
+        rows, self.pending = self.pending[:self.chunk_size], self.pending[self.chunk_size:]
+        self.write_chunk(rows)
+
+    def remove_tail(self):
+        if self.tail_offset is not None:
+            self.handle.seek(self.tail_offset)
+            self.handle.truncate()
+            self.index.pop()
+            self.tail_offset = None
+
+    def write_chunk(self, rows):
+        arrays = []
+        for i, (name, dtype) in enumerate(self.columns):
+            missing = -1 if np.dtype(dtype).kind == 'i' else np.nan
+            arrays.append(np.array([missing if row[i] is None else row[i] for row in rows], dtype=dtype))
+
+        timestamps = min_max(arrays[0].astype(np.float64))
+        distances = min_max(arrays[[name for name, _ in self.columns].index('distance')].astype(np.float64))
+
+        self.index.append((self.handle.tell(), len(rows)) + timestamps + distances)
+        self.handle.write(CHUNK.pack(CHUNK_MAGIC, len(rows), *timestamps, *distances))
+        for array in arrays:
+            data = array.tobytes()
+            self.handle.write(data + b"\0" * (aligned(len(data)) - len(data)))
+
+    def flush(self):
+        self.handle.flush()
+
+    def sync(self):
+        # pending rows are only safe on disk as a complete chunk
+        if len(self.pending):
+            self.remove_tail()
+            self.tail_offset = self.handle.tell()
+            self.write_chunk(self.pending)
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+
+    def close(self):
+        while len(self.pending):
+            self.write_pending()
+        self.write_index(self.handle, self.index)
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.handle.close()
+        os.replace(self.part_filename, self.filename)
+
+    @staticmethod
+    def write_index(handle, index):
+        offset = handle.tell()
+        for entry in index:
+            handle.write(INDEX_ENTRY.pack(*entry))
+        handle.write(TRAILER.pack(offset, len(index), TRAILER_MAGIC))
+
+    @classmethod
+    def recover(cls, part_filename, filename):
+        # keep the complete chunks and append their index
+        with open(part_filename, "rb+") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                _, _, index, end = SessionReader.scan(data)
+            f.truncate(end)
+            f.seek(end)
+            cls.write_index(f, index)
+        os.replace(part_filename, filename)
+
+
+class SessionReader:
+    """Memory-mapped reader of columnar session files.
+
+    `read()` returns numpy views of the columns, only chunks whose index overlaps the requested range are
+    touched.
+    """
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        _, self.columns, self.index = self.read_index(self.mapping)
+
+    @property
+    def fields(self):
+        return [name for name, _ in self.columns]
+
+    @staticmethod
+    def read_header(data):
+        magic, version, columns_length = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a session file")
+        columns = [tuple(column) for column in json.loads(bytes(data[HEADER.size:HEADER.size + columns_length]))]
+        return aligned(HEADER.size + columns_length), columns
+
+    @classmethod
+    def read_index(cls, data):
+        if len(data) >= TRAILER.size:
+            offset, count, magic = TRAILER.unpack_from(data, len(data) - TRAILER.size)
+            if magic == TRAILER_MAGIC:
+                data_offset, columns = cls.read_header(data)
+                index = [INDEX_ENTRY.unpack_from(data, offset + i * INDEX_ENTRY.size) for i in range(count)]
+                return data_offset, columns, index
+
+        # session has not been closed
+        data_offset, columns, index, _ = cls.scan(data)
+        return data_offset, columns, index
+
+    @classmethod
+    def scan(cls, data):
+        """Walk the chunks from the start, returns the header, the index and the end of the last complete chunk."""
+        data_offset, columns = cls.read_header(data)
+        widths = [np.dtype(dtype).itemsize for _, dtype in columns]
+
+        index = []
+        offset = data_offset
+        while offset + CHUNK.size <= len(data):
+            magic, count, *ranges = CHUNK.unpack_from(data, offset)
+            length = CHUNK.size + sum(aligned(count * width) for width in widths)
+            if magic != CHUNK_MAGIC or offset + length > len(data):
+                break
+            index.append((offset, count, *ranges))
+            offset += length
+
+        return data_offset, columns, index, offset
+
+    def chunk(self, entry):
+        offset, count = entry[0], entry[1]
+        offset += CHUNK.size
+
+        arrays = dict()
+        for name, dtype in self.columns:
+            arrays[name] = np.frombuffer(self.mapping, dtype=dtype, count=count, offset=offset)
+            offset += aligned(count * np.dtype(dtype).itemsize)
+        return arrays
+
+    def read(self, start=None, end=None, column='timestamp', fields=None):
+        """Rows with `start <= column <= end`, where column is 'timestamp' or 'distance'.
+
+        Returns a dict of arrays, views into the file if the range lies within a single chunk.
+        """
+        low, high = (2, 3) if column == 'timestamp' else (4, 5)
+        fields = fields if fields is not None else self.fields
+
+        parts = []
+        for entry in self.index:
+            if (start is not None and entry[high] < start) or (end is not None and entry[low] > end):
+                continue
+
+            arrays = self.chunk(entry)
+            if (start is None or entry[low] >= start) and (end is None or entry[high] <= end):
+                parts.append(dict((name, arrays[name]) for name in fields))
+            else:
+                # chunk on the border of the range
+                values = arrays[column]
+                mask = np.ones(len(values), dtype=bool)
+                if start is not None:
+                    mask &= values >= start
+                if end is not None:
+                    mask &= values <= end
+                parts.append(dict((name, arrays[name][mask]) for name in fields))
+
+        if len(parts) == 1:
+            return parts[0]
+        return dict((name, np.concatenate([part[name] for part in parts]) if len(parts)
+                     else np.empty(0, dtype=dict(self.columns)[name])) for name in fields)
@@ -0,0 +1,254 @@
+import csv
+import itertools
+import math
+import os
+import struct
+from datetime import datetime, timezone
+import numpy as np
+from common.log_columnar import SessionReader
+from common.log_writer import LogRecord
+
+
+def read_records(filename):
+    """Stream the records of a CSV or columnar session file."""
+    if filename.endswith(".k2s"):
+        session = SessionReader(filename)
+        for entry in session.index:
+            arrays = session.chunk(entry)
+            columns = []
+            for name in LogRecord.__slots__:
+                values = arrays[name]
+                missing = np.isnan(values) if values.dtype.kind == 'f' else values == -1
+                columns.append([None if m else value for m, value in zip(missing.tolist(), values.tolist())])
+            for values in zip(*columns):
+                yield LogRecord(*values)
+    else:
+        with open(filename, "r", newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            fields = next(reader)
+            for row in reader:
+                values = dict((field, float(value) if value != '' else None) for field, value in zip(fields, row))
+                yield LogRecord(*[values.get(name) for name in LogRecord.__slots__])
+
+
+def isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def export_gpx(records, filename):
+    """Write the records with a position as GPX track, with heart rate, cadence and power as extensions.
+
+    Returns the number of track points.
+    """
+    points = 0
+    with open(filename + ".tmp", "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<gpx version="1.1" creator="k2" xmlns="http://www.topografix.com/GPX/1/1" '
+                'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">\n'
+                ' <trk>\n  <type>VirtualRide</type>\n  <trkseg>\n')
+
+        for record in records:
+            if record.timestamp is None or record.position_lat is None or record.position_long is None:
+                continue
+
+            f.write('   <trkpt lat="%.7f" lon="%.7f">' % (record.position_lat, record.position_long))
+            if record.altitude is not None:
+                f.write('<ele>%.1f</ele>' % record.altitude)
+            f.write('<time>%s</time>' % isoformat(record.timestamp))
+
+            f.write('<extensions>')
+            if record.power is not None:
+                f.write('<power>%d</power>' % record.power)
+            if record.heart_rate is not None or record.cadence is not None:
+                f.write('<gpxtpx:TrackPointExtension>')
+                if record.heart_rate is not None:
+                    f.write('<gpxtpx:hr>%d</gpxtpx:hr>' % record.heart_rate)
+                if record.cadence is not None:
+                    f.write('<gpxtpx:cad>%d</gpxtpx:cad>' % record.cadence)
+                f.write('</gpxtpx:TrackPointExtension>')
+            f.write('</extensions></trkpt>\n')
+            points += 1
+
+        f.write('  </trkseg>\n </trk>\n</gpx>\n')
+
+    if points > 0:
+        os.replace(filename + ".tmp", filename)
+    else:
+        # sessions without a track, e.g. with the ANT+ controller
+        os.remove(filename + ".tmp")
+    return points
+
+
+# seconds between the unix and the FIT epoch (1989-12-31 00:00:00 UTC)
+FIT_EPOCH = 631065600
+
+FIT_CRC_TABLE = (0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
+                 0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400)
+
+# header size, protocol version, profile version, data size, ".FIT", header crc
+FIT_HEADER = struct.Struct("<BBHI4sH")
+
+# base types: (id, struct format, invalid value)
+ENUM = (0x00, "B", 0xFF)
+UINT8 = (0x02, "B", 0xFF)
+UINT16 = (0x84, "H", 0xFFFF)
+SINT32 = (0x85, "i", 0x7FFFFFFF)
+UINT32 = (0x86, "I", 0xFFFFFFFF)
+UINT32Z = (0x8C, "I", 0x00000000)
+
+# global message numbers and fields (field number, base type)
+FILE_ID = (0, ((0, ENUM), (1, UINT16), (2, UINT16), (3, UINT32Z), (4, UINT32)))
+RECORD = (20, ((253, UINT32), (0, SINT32), (1, SINT32), (2, UINT16), (3, UINT8), (4, UINT8),
+               (5, UINT32), (6, UINT16), (7, UINT16)))
+LAP = (19, ((253, UINT32), (0, ENUM), (1, ENUM), (2, UINT32), (7, UINT32), (8, UINT32), (9, UINT32)))
+SESSION = (18, ((253, UINT32), (0, ENUM), (1, ENUM), (2, UINT32), (5, ENUM), (6, ENUM),
+                (7, UINT32), (8, UINT32), (9, UINT32)))
+ACTIVITY = (34, ((253, UINT32), (0, UINT32), (1, UINT16), (2, ENUM), (3, ENUM), (4, ENUM)))
+
+
+def fit_crc(crc, data):
+    for byte in data:
+        tmp = FIT_CRC_TABLE[crc & 0xF]
+        crc = (crc >> 4) & 0x0FFF
+        crc = crc ^ tmp ^ FIT_CRC_TABLE[byte & 0xF]
+        tmp = FIT_CRC_TABLE[crc & 0xF]
+        crc = (crc >> 4) & 0x0FFF
+        crc = crc ^ tmp ^ FIT_CRC_TABLE[(byte >> 4) & 0xF]
+    return crc
+
+
+class FITWriter:
+    """Minimal streaming writer of FIT activity files, using one local message type per message."""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.data_size = 0
+        self.messages = dict()
+
+        self.handle.write(FIT_HEADER.pack(14, 0x10, 2132, 0, b".FIT", 0))
+
+    def write_bytes(self, data):
+        self.handle.write(data)
+        self.data_size += len(data)
+
+    def define(self, local, message):
+        global_number, fields = message
+        definition = struct.pack("<BBBHB", 0x40 | local, 0, 0, global_number, len(fields))
+        for number, (base_type, fmt, _) in fields:
+            definition += struct.pack("<BBB", number, struct.calcsize(fmt), base_type)
+        self.write_bytes(definition)
+        self.messages[local] = struct.Struct("<B" + "".join(fmt for _, (_, fmt, _) in fields)), fields
+
+    def write(self, local, *values):
+        # None is written as the invalid value of the field
+        data, fields = self.messages[local]
+        self.write_bytes(data.pack(local, *[invalid if value is None else value
+                                            for value, (_, (_, _, invalid)) in zip(values, fields)]))
+
+    def close(self):
+        # the header holds the data size, the file ends with a crc of header and data
+        self.handle.seek(0)
+        header = FIT_HEADER.pack(14, 0x10, 2132, self.data_size, b".FIT", 0)[:12]
+        self.handle.write(header + struct.pack("<H", fit_crc(0, header)))
+
+        self.handle.seek(0)
+        crc = 0
+        for chunk in iter(lambda: self.handle.read(1 << 16), b''):
+            crc = fit_crc(crc, chunk)
+        self.handle.seek(0, os.SEEK_END)
+        self.handle.write(struct.pack("<H", crc))
+
+
+def fit_records(records):
+    # one record per second, the latest one of each second
+    pending = None
+    for record in records:
+        if record.timestamp is None:
+            continue
+        if pending is not None and int(record.timestamp) != int(pending.timestamp):
+            yield pending
+        pending = record
+    if pending is not None:
+        yield pending
+
+
+def semicircles(degrees):
+    return None if degrees is None else int(round(degrees * 2 ** 31 / 180))
+
+
+def scaled(value, scale, offset=0, limit=None):
+    if value is None or math.isnan(value):
+        return None
+    value = int(round((value + offset) * scale))
+    return value if limit is None or 0 <= value < limit else None
+
+
+def export_fit(records, filename):
+    """Write the records as indoor cycling FIT activity, returns the number of records."""
+    records = fit_records(records)
+    first = next(records, None)
+    if first is None:
+        return 0
+
+    count = 0
+    with open(filename + ".tmp", "w+b") as f:
+        writer = FITWriter(f)
+        start = end = int(first.timestamp) - FIT_EPOCH
+        distance = None
+
+        # file id: activity, manufacturer development
+        writer.define(0, FILE_ID)
+        writer.write(0, 4, 255, 0, None, start)
+
+        writer.define(1, RECORD)
+        for record in itertools.chain([first], records):
+            timestamp = int(record.timestamp) - FIT_EPOCH
+            end = timestamp
+            distance = record.distance if record.distance is not None else distance
+
+            writer.write(1, timestamp, semicircles(record.position_lat), semicircles(record.position_long),
+                         scaled(record.altitude, 5, 500, 0xFFFF),
+                         scaled(record.heart_rate, 1, limit=0xFF), scaled(record.cadence, 1, limit=0xFF),
+                         scaled(record.distance, 100, limit=0xFFFFFFFF),
+                         scaled(record.speed and record.speed / 3.6, 1000, limit=0xFFFF),
+                         scaled(record.power, 1, limit=0xFFFF))
+            count += 1
+
+        elapsed = (end - start) * 1000
+        total_distance = scaled(distance, 100, limit=0xFFFFFFFF)
+
+        # lap and session: stop event, cycling, indoor cycling
+        writer.define(2, LAP)
+        writer.write(2, end, 9, 1, start, elapsed, elapsed, total_distance)
+        writer.define(3, SESSION)
+        writer.write(3, end, 8, 1, start, 2, 6, elapsed, elapsed, total_distance)
+        writer.define(4, ACTIVITY)
+        writer.write(4, end, elapsed, 1, 0, 26, 1)
+
+        writer.close()
+
+    os.replace(filename + ".tmp", filename)
+    return count
+
+
+EXPORTS = {
+    'gpx': export_gpx,
+    'fit': export_fit
+}
+
+
+def export_session(filenames, formats):
+    """Export a closed session, runs in a worker process.
+
+    Records are streamed from the columnar file of the session if there is one, else from the CSV file.
+    Returns the exported filenames.
+    """
+    source = next((filename for filename in filenames if filename.endswith(".k2s")), filenames[0])
+    base = os.path.splitext(source)[0]
+
+    exported = []
+    for export_format in formats:
+        filename = "%s.%s" % (base, export_format)
+        if EXPORTS[export_format](read_records(source), filename) > 0:
+            exported.append(filename)
+    return exported
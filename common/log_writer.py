@@ -0,0 +1,162 @@
+import collections
+import csv
+import glob
+import operator
+import os
+import struct
+import threading
+import time
+from common.log_columnar import ColumnarSink
+
+
+class LogRecord:
+    """Data point of a log session."""
+
+    __slots__ = ('timestamp', 'speed', 'cadence', 'power', 'distance',
+                 'position_lat', 'position_long', 'altitude', 'grade',
+                 'heart_rate', 'rri')
+
+    def __init__(self, *values):
+        for attribute in self.__slots__:
+            setattr(self, attribute, None)
+        for attribute, value in zip(self.__slots__, values):
+            setattr(self, attribute, value)
+
+    def values(self):
+        return _record_values(self)
+
+    def copy(self):
+        return LogRecord(*_record_values(self))
+
+
+_record_values = operator.attrgetter(*LogRecord.__slots__)
+
+
+class CSVSink:
+    """Writes records to a CSV file with one column per record field."""
+
+    extension = ".csv"
+
+    def __init__(self, filename, fields=LogRecord.__slots__):
+        self.filename = filename
+        self.part_filename = filename + ".part"
+
+        self.handle = open(self.part_filename, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.handle)
+        self.writer.writerow(fields)
+
+    def write(self, records):
+        self.writer.writerows(['' if value is None else value for value in record.values()] for record in records)
+
+    def flush(self):
+        self.handle.flush()
+
+    def sync(self):
+        os.fsync(self.handle.fileno())
+
+    def close(self):
+        self.handle.flush()
+        self.sync()
+        self.handle.close()
+        os.replace(self.part_filename, self.filename)
+
+    @staticmethod
+    def recover(part_filename, filename):
+        # drop a partially written last row
+        with open(part_filename, "rb+") as f:
+            data = f.read()
+            f.truncate(data.rfind(b"\n") + 1)
+        os.replace(part_filename, filename)
+
+
+# sink of each log format, see logger['formats']. Sessions are written to <filename>.part until they are closed
+FORMATS = {
+    'csv': CSVSink,
+    'k2s': ColumnarSink
+}
+SINKS = dict((sink.extension, sink) for sink in FORMATS.values())
+
+
+def recover_logs(path):
+    """Complete the sessions of log files left behind by a crash."""
+    for part_filename in glob.glob(os.path.join(path, "*.part")):
+        filename = part_filename[:-len(".part")]
+        sink = SINKS.get(os.path.splitext(filename)[1])
+        if sink is None:
+            continue
+        try:
+            sink.recover(part_filename, filename)
+            print(f"[Logger] Recovered log: {filename}")
+        except (OSError, ValueError, struct.error) as e:
+            print(f"[Logger] Could not recover log {part_filename}: {str(e)}")
+
+
+class LogWriter(threading.Thread):
+    """Writes the records of a log session to its sinks from a background thread.
+
+    Records are appended to a ring buffer by the event loop and written in batches every `flush_interval`
+    seconds, the files are synced to disk every `fsync_interval` seconds. If the writer falls behind by more
+    than `capacity` records, the oldest records are dropped.
+    """
+
+    def __init__(self, sinks, flush_interval=1.0, fsync_interval=10.0, capacity=10000):
+        super().__init__(name="LogWriter", daemon=True)
+        self.sinks = sinks
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+
+        self.buffer = collections.deque(maxlen=capacity)
+        self.appended = 0
+        self.written = 0
+        self.error = None
+
+        self.closed = threading.Event()
+
+    def append(self, record):
+        # called from the event loop, never blocks
+        if self.error is not None:
+            return
+        self.buffer.append(record.copy())
+        self.appended += 1
+
+    @property
+    def dropped(self):
+        return self.appended - self.written - len(self.buffer)
+
+    def close(self):
+        self.closed.set()
+        self.join()
+
+    def run(self):
+        try:
+            last_sync = time.monotonic()
+            while not self.closed.wait(self.flush_interval):
+                self.write_batch()
+
+                if time.monotonic() - last_sync >= self.fsync_interval:
+                    for sink in self.sinks:
+                        sink.sync()
+                    last_sync = time.monotonic()
+
+            self.write_batch()
+            for sink in self.sinks:
+                sink.close()
+        except Exception as e:
+            # e.g. OSError or csv.Error, the .part files are completed by recover_logs on the next start
+            self.error = e
+            self.buffer.clear()
+            print(f"[Logger] Could not write log: {repr(e)}")
+
+    def write_batch(self):
+        records = []
+        try:
+            while True:
+                records.append(self.buffer.popleft())
+        except IndexError:
+            pass
+
+        if len(records):
+            for sink in self.sinks:
+                sink.write(records)
+                sink.flush()
+            self.written += len(records)
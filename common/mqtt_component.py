@@ -1,24 +1,131 @@
 import asyncio
+import dataclasses
 from asyncio_mqtt import Client, MqttError, Will
 import json
+import msgpack
 import time
 from contextlib import AsyncExitStack
 from common.json_encoder import EnhancedJSONEncoder
 
-def handle_pattern(topic_pattern):
+def handle_pattern(topic_pattern, schema=None):
+    # with a schema, handlers receive TypedMessages with the payload decoded into the schema
     def _handle_pattern(f):
         f.topic_pattern = topic_pattern
+        f.schema = schema
         return f
     return _handle_pattern
 
+
+class TypedMessage:
+    __slots__ = ('topic', 'payload', 'timestamp')
+
+    def __init__(self, topic, payload, timestamp):
+        self.topic = topic
+        self.payload = payload
+        self.timestamp = timestamp
+
+
+class DecodeError(ValueError):
+    pass
+
+
+class JSONCodec:
+    name = 'json'
+
+    @staticmethod
+    def encode(data):
+        if hasattr(data, "to_json"):
+            # records serialize themselves, skips the encoder's fallback
+            data = data.to_json()
+        return json.dumps(data, cls=EnhancedJSONEncoder)
+
+    @staticmethod
+    def wrap(payload, timestamp):
+        # same as encoding {'payload': data, '_timestamp': timestamp}, without serializing the payload again
+        return '{"payload": %s, "_timestamp": %s}' % (payload, json.dumps(timestamp))
+
+    @staticmethod
+    def decode(message):
+        try:
+            return json.loads(message.decode("utf-8"))
+        except ValueError as e:
+            raise DecodeError(str(e))
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+
+    WRAPPER_PAYLOAD = b"\x82" + msgpack.packb("payload", use_bin_type=True)
+    WRAPPER_TIMESTAMP = msgpack.packb("_timestamp", use_bin_type=True)
+
+    @staticmethod
+    def default(o):
+        if dataclasses.is_dataclass(o):
+            return dataclasses.asdict(o)
+        if hasattr(o, "to_json"):
+            return o.to_json()
+        raise TypeError(f"Cannot serialize {type(o)}")
+
+    @staticmethod
+    def encode(data):
+        if hasattr(data, "to_json"):
+            data = data.to_json()
+        return msgpack.packb(data, default=MsgpackCodec.default, use_bin_type=True)
+
+    @staticmethod
+    def wrap(payload, timestamp):
+        # map with two entries, same as encoding {'payload': data, '_timestamp': timestamp}
+        return MsgpackCodec.WRAPPER_PAYLOAD + payload + \
+               MsgpackCodec.WRAPPER_TIMESTAMP + msgpack.packb(timestamp, use_bin_type=True)
+
+    @staticmethod
+    def decode(message):
+        try:
+            return msgpack.unpackb(message, raw=False)
+        except (ValueError, msgpack.exceptions.UnpackException) as e:
+            raise DecodeError(str(e))
+
+
+# wire formats of retained topics. JSON is published on the topic itself, other codecs on <topic>/<codec>
+CODECS = {
+    'json': JSONCodec,
+    'msgpack': MsgpackCodec
+}
+DEFAULT_CODECS = ('json',)
+
+@dataclasses.dataclass
+class TopicState:
+    payload: str = None         # last published payload, without timestamp
+    published_at: float = None  # monotonic time of the last publish
+    pending: tuple = None       # (payload, encode, retain) waiting for the next publish slot
+    flush_task: asyncio.Task = None
+
+    published: int = 0          # messages sent to the broker
+    suppressed: int = 0         # messages dropped as duplicates of the last published payload
+    coalesced: int = 0          # messages replaced by a newer one before their publish slot
+
+
 class Component2MQTT:
-    def __init__(self, mqtt):
+    # publish policy of topics without an entry in the publish policy
+    UPDATE_POLICY = {'dedup': True}
+    COMMAND_POLICY = {}
+
+    STATISTICS_INTERVAL = 60
+
+    def __init__(self, mqtt, publish_policy=None):
         self.mqtt = mqtt
         self.client = None
         self.handler_tasks = []
 
         self.handlers = dict()
 
+        # per topic publish policy, see config.mqtt_publish
+        self.publish_policy = publish_policy if publish_policy is not None else dict()
+        self.topic_states = dict()
+
+        # last decoded (message, schema, typed message), messages are shared between handlers of a topic
+        self.decoded = (None, None, None)
+
     async def mqtt_connect(self, will_topic):
         while True:
             try:
@@ -32,6 +139,9 @@ class Component2MQTT:
                     await stack.enter_async_context(self.client)
                     print("[MQTT] Connected.")
 
+                    # the broker may have lost retained messages, publish everything again
+                    self.reset_topic_states()
+
                     await self.update_mqtt(f"status/{will_topic}", {"connected": True})
                     await self.on_connect()
 
@@ -39,12 +149,17 @@ class Component2MQTT:
                     # find all registered handlers in class attributes
                     for func in self.__class__.__dict__.values():
                         if callable(func) and hasattr(func, "topic_pattern"):
-                            topic_pattern = getattr(func, "topic_pattern")
+                            topic_pattern = self.codec_topic(getattr(func, "topic_pattern"),
+                                                             self.subscription_codec(getattr(func, "topic_pattern")))
                             messages = await stack.enter_async_context(
                                 self.client.filtered_messages(f"{self.mqtt['base_topic']}/{topic_pattern}"))
+                            if getattr(func, "schema") is not None:
+                                messages = self.typed_messages(messages, getattr(func, "schema"))
                             self.handler_tasks.append(asyncio.create_task(func(self, messages)))
                             await self.client.subscribe(f"{self.mqtt['base_topic']}/{topic_pattern}")
 
+                    self.handler_tasks.append(asyncio.create_task(self.statistics_task(will_topic)))
+
                     try:
                         if len(self.handlers):
                             await asyncio.gather(*self.handler_tasks)
@@ -71,28 +186,154 @@ class Component2MQTT:
     async def on_cancel(self):
         return
 
-    async def update_mqtt(self, key, data, precise_timestamps = False):
-        if precise_timestamps:
-            data = {
-                'payload': data,
-                '_timestamp': int(time.time_ns() / 1000000) / 1000
-            }
+    async def update_mqtt(self, key, data, precise_timestamps = False, timestamp=None):
+        # timestamp: wall clock time of the data in s, e.g. when it has been received
+        if timestamp is not None:
+            timestamp = int(timestamp * 1000) / 1000
+        elif precise_timestamps:
+            timestamp = int(time.time_ns() / 1000000) / 1000
         else:
-            data = {
-                'payload': data,
-                '_timestamp': int(time.time())
-            }
+            timestamp = int(time.time())
 
-        if self.client is not None:
-            await self.client.publish(f"{self.mqtt['base_topic']}/{key}",
-                                      json.dumps(data, cls=EnhancedJSONEncoder),
-                                      retain=True)
+        policy = self.publish_policy.get(key, self.UPDATE_POLICY)
+        codecs = [CODECS[codec] for codec in policy.get('codecs', DEFAULT_CODECS)]
+
+        # the payload in the first codec is used to detect changes
+        payload = codecs[0].encode(data)
+
+        def encode():
+            return [(self.codec_topic(key, codec), codec.wrap(payload if codec is codecs[0] else codec.encode(data),
+                                                              timestamp))
+                    for codec in codecs]
+
+        await self.publish(key, payload, encode, retain=True, policy=policy)
 
     async def send_command(self, key, data):
-        await self.client.publish(f"{self.mqtt['base_topic']}/{key}", data)
+        await self.publish(key, str(data), lambda: [(key, data)], retain=False,
+                           policy=self.publish_policy.get(key, self.COMMAND_POLICY))
 
     async def clear_topic(self, key):
-        await self.client.publish(f"{self.mqtt['base_topic']}/{key}", "")
+        self.reset_topic_state(key)
+        for codec in self.publish_policy.get(key, self.UPDATE_POLICY).get('codecs', DEFAULT_CODECS):
+            await self.client.publish(f"{self.mqtt['base_topic']}/{self.codec_topic(key, CODECS[codec])}", "")
+
+    @staticmethod
+    def codec_topic(key, codec):
+        return key if codec is JSONCodec else f"{key}/{codec.name}"
+
+    def subscription_codec(self, topic_pattern):
+        # subscribers use the last codec a topic is published in
+        return CODECS[self.publish_policy.get(topic_pattern, self.UPDATE_POLICY).get('codecs', DEFAULT_CODECS)[-1]]
+
+    @staticmethod
+    def decode_message(message):
+        codec = CODECS.get(message.topic.rsplit("/", 1)[-1], JSONCodec)
+        return codec.decode(message.payload)
+
+    def decode_typed(self, message, schema):
+        message_, schema_, typed = self.decoded
+        if message is message_ and schema is schema_:
+            return typed
+
+        data = self.decode_message(message)
+        from_payload = getattr(schema, "from_payload", None)
+        payload = from_payload(data['payload']) if from_payload is not None else schema(**data['payload'])
+
+        typed = TypedMessage(message.topic, payload, data['_timestamp'])
+        self.decoded = (message, schema, typed)
+        return typed
+
+    async def typed_messages(self, messages, schema):
+        async for message in messages:
+            try:
+                yield self.decode_typed(message, schema)
+            except (DecodeError, KeyError, TypeError) as e:
+                # e.g. cleared topics
+                if len(message.payload):
+                    print(f"[MQTT] Could not decode {message.topic}: {str(e)}")
+
+    async def publish(self, key, payload, encode, retain, policy):
+        """Publish the messages returned by `encode()`, applying the publish policy of the topic.
+
+        `payload` is compared with the last published payload of the topic. With `dedup`, unchanged payloads
+        are dropped unless the last publish is older than `refresh` seconds. With `max_rate`, messages
+        arriving faster are coalesced and only the latest one is published in the next free slot.
+        """
+        state = self.topic_states.get(key)
+        if state is None:
+            state = self.topic_states[key] = TopicState()
+
+        now = time.monotonic()
+
+        if policy.get('dedup') and payload == state.payload and \
+                (policy.get('refresh') is None or now - state.published_at < policy['refresh']):
+            if state.pending is not None:
+                # the pending message is outdated and the broker already has the current payload
+                state.pending = None
+                state.coalesced += 1
+            state.suppressed += 1
+            return
+
+        if policy.get('max_rate') and state.published_at is not None:
+            next_slot = state.published_at + 1 / policy['max_rate']
+            if now < next_slot:
+                if state.pending is not None:
+                    state.coalesced += 1
+                state.pending = (payload, encode, retain)
+                if state.flush_task is None:
+                    state.flush_task = asyncio.create_task(self.flush_topic(key, state, next_slot - now))
+                return
+
+        state.pending = None
+        await self.send(state, payload, encode, retain)
+
+    async def flush_topic(self, key, state, delay):
+        await asyncio.sleep(delay)
+        state.flush_task = None
+
+        if state.pending is not None:
+            payload, encode, retain = state.pending
+            state.pending = None
+            await self.send(state, payload, encode, retain)
+
+    async def send(self, state, payload, encode, retain):
+        state.payload = payload
+        state.published_at = time.monotonic()
+        state.published += 1
+
+        if self.client is not None:
+            for topic, message in encode():
+                await self.client.publish(f"{self.mqtt['base_topic']}/{topic}", message, retain=retain)
+
+    def reset_topic_state(self, key):
+        # forget the last published payload, so the next message is published in any case
+        state = self.topic_states.get(key)
+        if state is not None:
+            if state.flush_task is not None:
+                state.flush_task.cancel()
+            self.topic_states[key] = TopicState(published=state.published,
+                                                suppressed=state.suppressed,
+                                                coalesced=state.coalesced)
+
+    def reset_topic_states(self):
+        for key in list(self.topic_states.keys()):
+            self.reset_topic_state(key)
+
+    def publish_statistics(self):
+        return dict([(key, {'published': state.published,
+                            'suppressed': state.suppressed,
+                            'coalesced': state.coalesced})
+                     for key, state in self.topic_states.items()])
+
+    async def statistics_task(self, will_topic):
+        try:
+            while True:
+                await asyncio.sleep(self.STATISTICS_INTERVAL)
+                await self.client.publish(f"{self.mqtt['base_topic']}/status/{will_topic}/publish",
+                                          json.dumps(self.publish_statistics()),
+                                          retain=True)
+        except MqttError:
+            return
 
     @staticmethod
     async def cancel_task(task):
@@ -0,0 +1,26 @@
+class Odometer:
+    """Integrates the speed reported by the bike into a distance.
+
+    Each sample is stamped with the monotonic time it has been received, so the distance does not depend on
+    how regularly the bike is polled. The speed is assumed to change linearly between two samples
+    (trapezoidal rule).
+    """
+
+    def __init__(self):
+        self.distance = 0.0
+        self.speed = None
+        self.timestamp = None
+
+    def reset(self):
+        self.distance = 0.0
+        self.speed = None
+        self.timestamp = None
+
+    def add(self, speed, timestamp):
+        """Add a speed sample in m/s received at the monotonic `timestamp` in s, returns the distance in m."""
+        if self.timestamp is not None and timestamp > self.timestamp:
+            self.distance += (self.speed + speed) / 2 * (timestamp - self.timestamp)
+
+        self.speed = speed
+        self.timestamp = timestamp
+        return self.distance
@@ -0,0 +1,85 @@
+import collections
+
+
+class FusionStream:
+    """Timestamped samples of one sensor.
+
+    Values are linearly interpolated between the samples around the requested time for the fields in
+    `interpolate`, other fields hold the value of the last sample. Samples older than `max_age` seconds are
+    stale and not used.
+    """
+
+    def __init__(self, fields, max_age, interpolate=(), capacity=1000):
+        self.fields = fields
+        self.max_age = max_age
+        self.interpolate = [field in interpolate for field in fields]
+
+        self.samples = collections.deque(maxlen=capacity)
+
+    def add(self, timestamp, values):
+        # samples arriving out of order are dropped
+        if len(self.samples) and timestamp < self.samples[-1][0]:
+            return
+        self.samples.append((timestamp, values))
+
+    def clear(self):
+        self.samples.clear()
+
+    def sample(self, timestamp):
+        """Values at `timestamp`, None if there is no recent sample. Timestamps must not decrease between calls."""
+        samples = self.samples
+
+        # only the last sample before the requested time is needed anymore
+        while len(samples) > 1 and samples[1][0] <= timestamp:
+            samples.popleft()
+
+        if len(samples) == 0 or samples[0][0] > timestamp:
+            return None
+
+        t0, values0 = samples[0]
+        if timestamp - t0 > self.max_age:
+            return None
+
+        if len(samples) == 1 or samples[1][0] - t0 > self.max_age:
+            return values0
+
+        t1, values1 = samples[1]
+        fraction = (timestamp - t0) / (t1 - t0)
+        values = []
+        for a, b, interpolate in zip(values0, values1, self.interpolate):
+            if interpolate and a is not None and b is not None:
+                a = a + (b - a) * fraction
+            values.append(a)
+        return values
+
+
+class SensorFusion:
+    """Aligns the samples of several sensors on a fixed output rate.
+
+    Rows are only complete for times at least `delay` seconds in the past, when the samples after them have
+    arrived. A row is emitted while the `primary` stream is fresh, fields of stale streams are None.
+    """
+
+    def __init__(self, streams, primary, rate=1, delay=1.0):
+        self.streams = streams
+        self.primary = primary
+        self.interval = 1 / rate
+        self.delay = delay
+
+    def add(self, name, timestamp, values):
+        self.streams[name].add(timestamp, values)
+
+    def clear(self, name):
+        self.streams[name].clear()
+
+    def row(self, timestamp):
+        """Field values of all streams at `timestamp`, None if the primary stream is stale."""
+        row = dict()
+        for name, stream in self.streams.items():
+            values = stream.sample(timestamp)
+            if values is None:
+                if name == self.primary:
+                    return None
+                values = [None] * len(stream.fields)
+            row.update(zip(stream.fields, values))
+        return row
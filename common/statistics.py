@@ -0,0 +1,23 @@
+class MovingStatistics:
+    """Count, exponential moving average, minimum and maximum of a measured value, e.g. a latency."""
+
+    __slots__ = ('count', 'average', 'minimum', 'maximum')
+
+    # weight of a new sample in the moving average
+    SMOOTHING = 0.1
+
+    def __init__(self):
+        self.count = 0
+        self.average = None
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        self.count += 1
+        self.average = value if self.average is None else \
+            (1 - self.SMOOTHING) * self.average + self.SMOOTHING * value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def to_json(self, name):
+        return {name: self.average, f"{name}_min": self.minimum, f"{name}_max": self.maximum}
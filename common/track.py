@@ -0,0 +1,202 @@
+import flexpolyline
+import math
+import numpy as np
+from dataclasses import dataclass
+
+
+@dataclass
+class DistanceTrackInfo:
+    latitude: float
+    longitude: float
+    elevation: float
+    grade: float
+    progress: float
+
+
+class Track:
+    """Array-backed track geometry shared by the GPX and Komoot readers.
+
+    Points are held as contiguous float64 arrays; segment distances, cumulative distances and grades
+    are computed in one vectorized pass.
+    """
+
+    R = 6372800  # Earth radius in meters
+
+    def __init__(self, latitudes, longitudes, elevations, distances=None):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.elevations = np.asarray(elevations, dtype=np.float64)
+
+        if distances is None:
+            # distances of each waypoint-segment
+            self.segment_distances = self.haversine(self.latitudes[:-1], self.longitudes[:-1],
+                                                    self.latitudes[1:], self.longitudes[1:])
+
+            # accumulated distances at each point (total distance)
+            self.distances = np.concatenate(([0.0], np.cumsum(self.segment_distances)))
+        else:
+            self.distances = np.asarray(distances, dtype=np.float64)
+            self.segment_distances = np.diff(self.distances)
+
+        # accumulated distances at the end of each waypoint-segment
+        self.accumulated_distances = self.distances[1:]
+
+        self.ascends_m = np.diff(self.elevations)
+        self.grades = np.divide(self.ascends_m, self.segment_distances,
+                                out=np.zeros_like(self.ascends_m), where=self.segment_distances > 0)
+
+        # distance-resampled grade profile, see resample_grades()
+        self.grade_profile = None
+        self.grade_resolution = None
+        self.grade_lookahead = 0
+
+        self.cursor = TrackCursor(self)
+
+    @property
+    def total_distance(self):
+        return float(self.distances[-1])
+
+    @property
+    def ascent_m(self):
+        return float(self.ascends_m[self.ascends_m >= 0].sum())
+
+    @property
+    def descend_m(self):
+        return float(self.ascends_m[self.ascends_m < 0].sum())
+
+    @property
+    def max_ascent_grade(self):
+        return float(self.grades.max(initial=0))
+
+    @property
+    def max_descend_grade(self):
+        return float(self.grades.min(initial=0))
+
+    def get_info_at_distance(self, at_distance):
+        return self.cursor.get_info_at_distance(at_distance)
+
+    def resample_grades(self, resolution=10, smoothing=0, lookahead=0):
+        """Precompute a grade profile sampled every `resolution` meters.
+
+        Elevations are smoothed with a moving average over `smoothing` meters before the grades are taken,
+        and lookups read the grade `lookahead` meters ahead of the current position.
+        """
+        sample_distances = np.append(np.arange(0, self.total_distance, resolution), self.total_distance)
+        sample_elevations = np.interp(sample_distances, self.distances, self.elevations)
+
+        window = int(round(smoothing / resolution))
+        if window > 1:
+            kernel = np.ones(window)
+            # normalize by the number of samples in the window to avoid pulling the track ends towards zero
+            sample_elevations = np.convolve(sample_elevations, kernel, mode='same') / \
+                np.convolve(np.ones_like(sample_elevations), kernel, mode='same')
+
+        sample_lengths = np.diff(sample_distances)
+        grades = np.divide(np.diff(sample_elevations), sample_lengths,
+                           out=np.zeros_like(sample_lengths), where=sample_lengths > 0)
+
+        # plain list for cheap scalar lookups on every tick
+        self.grade_profile = grades.tolist() or [0.0]
+        self.grade_resolution = resolution
+        self.grade_lookahead = lookahead
+
+    def get_grade_at_distance(self, at_distance):
+        index = int((at_distance + self.grade_lookahead) // self.grade_resolution)
+        return self.grade_profile[max(0, min(index, len(self.grade_profile) - 1))]
+
+    def get_progress_at_distance(self, at_distance):
+        # force progress to [0, 1]
+        return max(0, min(1, at_distance/self.total_distance))
+
+    def to_polyline(self):
+        return flexpolyline.encode(list(zip(self.latitudes.tolist(), self.longitudes.tolist(), self.elevations.tolist())),
+                                   third_dim=flexpolyline.ALTITUDE,
+                                   precision=6,
+                                   third_dim_precision=2)
+
+    @staticmethod
+    def haversine(lat1, lon1, lat2, lon2):
+        phi1, phi2 = np.radians(lat1), np.radians(lat2)
+        dphi = np.radians(lat2 - lat1)
+        dlambda = np.radians(lon2 - lon1)
+
+        a = np.sin(dphi / 2) ** 2 + \
+            np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+
+        return 2 * Track.R * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+class TrackCursor:
+    """Stateful position lookup on a track.
+
+    Ride distance only grows, so the cursor walks forward from the last segment and only falls back
+    to a binary search on a reset, a backwards jump or a jump across many segments.
+    """
+
+    # maximum number of segments to walk before falling back to a binary search
+    MAX_WALK = 8
+
+    def __init__(self, track):
+        self.track = track
+        self.segment_index = 0
+        self.segment = None
+
+        # distance range covered by the current segment
+        self.lower = self.upper = 0
+
+    def reset(self):
+        self.segment_index = 0
+        self.segment = None
+        self.lower = self.upper = 0
+
+    def seek(self, at_distance):
+        if self.lower < at_distance <= self.upper:
+            return self.segment
+
+        ends = self.track.accumulated_distances
+        last = len(ends) - 1
+        index = self.segment_index
+
+        if index > 0 and at_distance <= ends[index - 1] or ends[min(index + self.MAX_WALK, last)] < at_distance:
+            index = min(int(np.searchsorted(ends, at_distance)), last)
+        else:
+            while index < last and ends[index] < at_distance:
+                index += 1
+
+        self.segment_index = index
+        self.segment = self.load_segment(index)
+
+        # the first and last segment also cover all distances before and after the track
+        self.lower = float(ends[index - 1]) if index > 0 else -math.inf
+        self.upper = float(ends[index]) if index < last else math.inf
+
+        return self.segment
+
+    def load_segment(self, start):
+        # waypoint-segment from point start to point start + 1, as plain floats for the per-tick math
+        track = self.track
+        end = start + 1
+        return (float(track.distances[end]), float(track.segment_distances[start]), float(track.grades[start]),
+                float(track.latitudes[start]), float(track.latitudes[end]),
+                float(track.longitudes[start]), float(track.longitudes[end]),
+                float(track.elevations[start]), float(track.elevations[end]))
+
+    def get_info_at_distance(self, at_distance):
+        end_distance, segment_distance, grade, lat1, lat2, lon1, lon2, ele1, ele2 = self.seek(at_distance)
+
+        # force progress to [0, 1]
+        if segment_distance > 0:
+            segment_progress = max(0.0, min(1.0, 1 - (end_distance - at_distance) / segment_distance))
+        else:
+            segment_progress = 1.0
+
+        # interpolate coordinates
+        progress_latitude = (1-segment_progress)*lat1 + segment_progress*lat2
+        progress_longitude = (1-segment_progress)*lon1 + segment_progress*lon2
+        progress_elevation = (1-segment_progress)*ele1 + segment_progress*ele2
+
+        if self.track.grade_profile is not None:
+            grade = self.track.get_grade_at_distance(at_distance)
+
+        return DistanceTrackInfo(progress_latitude, progress_longitude, progress_elevation,
+                                 grade, self.track.get_progress_at_distance(at_distance))
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import struct
+import numpy as np
+
+# magic, version, source mtime (ns), source size, source sha1, point count, overview length
+HEADER = struct.Struct("<4sHxxqq20sII")
+MAGIC = b"K2TI"
+VERSION = 1
+
+# packed float64 arrays stored after the overview, in this order
+COLUMNS = ("latitudes", "longitudes", "elevations", "distances")
+
+
+class TrackIndex:
+    """Binary index of a track file.
+
+    The index stores the track overview as JSON followed by packed lat/lon/elevation/cumulative distance
+    arrays, so a track can be loaded with a single read instead of parsing the source file again. Indexes
+    are read into memory and closed, hundreds of tracks must not hold a file descriptor each.
+    """
+
+    def __init__(self, index_file, overview, columns):
+        self.index_file = index_file
+        self.overview = overview
+        self.columns = columns
+
+    @staticmethod
+    def index_filename(filename, index_path):
+        return os.path.join(index_path, "%s.idx" % os.path.basename(filename))
+
+    @staticmethod
+    def file_hash(filename):
+        sha1 = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                sha1.update(chunk)
+        return sha1.digest()
+
+    @classmethod
+    def load_or_build(cls, filename, index_path, build):
+        """Return the index of `filename`, rebuilding it with `build()` if the source has changed.
+
+        `build` returns a tuple of the overview dict and the latitude, longitude, elevation and
+        cumulative distance sequences.
+        """
+        index_file = cls.index_filename(filename, index_path)
+        stat = os.stat(filename)
+
+        try:
+            index = cls.load(index_file, filename, stat)
+            if index is not None:
+                return index
+        except (OSError, ValueError, struct.error) as e:
+            print(f"[TrackIndex] Could not read index {index_file}: {str(e)}")
+
+        overview, *columns = build()
+        try:
+            cls.write(index_file, stat, cls.file_hash(filename), overview, columns)
+        except OSError as e:
+            # the parsed track is used without an index
+            print(f"[TrackIndex] Could not write index {index_file}: {str(e)}")
+        return cls(index_file, overview, dict(zip(COLUMNS, columns)))
+
+    @classmethod
+    def load(cls, index_file, filename, stat):
+        if not os.path.exists(index_file):
+            return None
+
+        with open(index_file, 'rb') as f:
+            data = f.read()
+
+        magic, version, mtime_ns, size, sha1, count, overview_length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            return None
+
+        if (mtime_ns, size) != (stat.st_mtime_ns, stat.st_size):
+            # file has been touched, only rebuild if the content changed
+            if size != stat.st_size or sha1 != cls.file_hash(filename):
+                return None
+
+            try:
+                with open(index_file, 'r+b') as f:
+                    f.write(HEADER.pack(MAGIC, VERSION, stat.st_mtime_ns, stat.st_size, sha1, count, overview_length))
+            except OSError as e:
+                # still valid, the content is compared again on the next start
+                print(f"[TrackIndex] Could not update index {index_file}: {str(e)}")
+
+        overview = json.loads(data[HEADER.size:HEADER.size + overview_length].decode("utf-8"))
+
+        offset = cls.data_offset(overview_length)
+        values = np.frombuffer(data, dtype='<f8', count=len(COLUMNS) * count, offset=offset)
+        columns = dict([(name, values[i * count:(i + 1) * count]) for i, name in enumerate(COLUMNS)])
+
+        return cls(index_file, overview, columns)
+
+    @classmethod
+    def write(cls, index_file, stat, sha1, overview, columns):
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+
+        overview_data = json.dumps(overview).encode("utf-8")
+        count = len(columns[0])
+
+        temp_file = index_file + ".tmp"
+        with open(temp_file, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, stat.st_mtime_ns, stat.st_size, sha1, count, len(overview_data)))
+            f.write(overview_data)
+            # align arrays to 8 bytes
+            f.write(b"\0" * (cls.data_offset(len(overview_data)) - HEADER.size - len(overview_data)))
+            for column in columns:
+                f.write(np.ascontiguousarray(column, dtype='<f8').tobytes())
+
+        os.replace(temp_file, index_file)
+
+    @staticmethod
+    def data_offset(overview_length):
+        return (HEADER.size + overview_length + 7) & ~7
@@ -1,28 +1,67 @@
 heartrate = {
     'adapter': 'hci0',
-    'macs': ['FB:E1:27:30:7A:7D']
+    # devices are published on heartrate/<name>/..., the first one also on heartrate/...
+    'devices': [
+        {'name': 'strap', 'mac': 'FB:E1:27:30:7A:7D'}
+    ],
+    'scan_timeout': 10,     # s to scan for the devices on start
+    'reconnect_min': 1,     # s before reconnecting after an error, doubled after each failed attempt
+    'reconnect_max': 60,
+    'hrv_interval': 5,      # publish heart rate variability every s
+    'hrv_window': 120,      # RR intervals of the last s used for heart rate variability
+    'hrv_min_beats': 50     # minimum number of RR intervals before heart rate variability is published
 }
 
 antplus = {
     'sensor_id': 12345,
     'vendor_id': 0x0fcf,
-    'product_id': 0x1008
+    'product_id': 0x1008,
+    # broadcast profiles, each on its own channel: fec (fitness equipment, controllable), power (bicycle power),
+    # speed_cadence (bicycle speed and cadence), heartrate (from heartrate/data)
+    'profiles': ['fec', 'power', 'speed_cadence', 'heartrate']
 }
 
 kettler = {
-    'port': '/dev/kettler'
+    'port': '/dev/kettler',
+    'mode_change_after': 3,     # consecutive statuses not confirming the target power before changing the mode
+    'mode_change_cooldown': 5   # minimum time between mode changes in s
 }
 
 logger = {
-    'path': '/home/pi/k2/logs'
+    'path': '/home/pi/k2/logs',
+    'formats': ['csv', 'k2s'],  # csv and/or chunked columnar session files (see common/log_columnar.py)
+    'flush_interval': 1,        # write buffered records every s
+    'fsync_interval': 10,       # sync log files to disk every s
+    'buffer_size': 10000,       # records kept in memory if writing falls behind
+    'rate': 1,                  # rows written per s
+    'delay': 1,                 # rows are written for the time delay s ago, to interpolate with later samples
+    'max_age': {                # s after which the last sample of a sensor is stale and its fields are empty
+        'kettler': 5,
+        'heartrate': 5,
+        'location': 10
+    },
+    'export': ['gpx', 'fit']    # formats to export closed sessions to
 }
 
 gpx = {
-    'path': '/home/pi/k2/tracks'
+    'path': '/home/pi/k2/tracks',
+    'index_path': '/home/pi/k2/tracks/.index'
+}
+
+grade = {
+    'resolution': 10,   # distance between samples of the grade profile in m
+    'smoothing': 50,    # length of the moving average over the elevation in m
+    'lookahead': 10     # distance ahead of the current position to read the grade from in m
 }
 
 komoot = {
-    'user_id': 938424577470
+    'user_id': 938424577470,
+    'api_url': 'https://api.komoot.de/v007',
+    'web_api_url': 'https://www.komoot.com/api/v007',
+    'cache_path': '/home/pi/k2/komoot',
+    'cache_size': 100 * 1024 * 1024,    # in bytes
+    'cache_max_age': 24 * 3600,         # in s, older entries are revalidated with Komoot
+    'offline': False                    # only use cached tours
 }
 
 power = {
@@ -42,4 +81,20 @@ mqtt_credentials = {
     'server': '127.0.0.1',
     'port': 1883,
     'base_topic': 'k2'
+}
+
+# publish policy per topic, relative to the base topic
+#   dedup:    drop messages with the same payload as the last published one
+#   refresh:  publish unchanged payloads again after this many seconds
+#   max_rate: publish at most this many messages per second, only the latest message is kept
+#   codecs:   wire formats of the topic, 'json' is published on the topic itself and e.g. 'msgpack' on
+#             <topic>/msgpack. Subscribers of the topic (pattern) use the last listed codec.
+# topics without an entry are deduplicated JSON for updates and sent as they are for commands.
+# Topics of the logger sensor fusion are refreshed more often than logger['max_age'], or they would become stale
+mqtt_publish = {
+    'kettler/data': {'dedup': True, 'refresh': 2, 'codecs': ['json', 'msgpack']},
+    'heartrate/data': {'dedup': False},
+    'controller/location': {'dedup': True, 'refresh': 2, 'max_rate': 5, 'codecs': ['json', 'msgpack']},
+    'controller/highlight': {'dedup': True, 'max_rate': 1},
+    'kettler/cmnd/power': {'dedup': True, 'refresh': 10, 'max_rate': 5}
 }
\ No newline at end of file
@@ -1,17 +1,17 @@
 import asyncio
 import os
 
-from common.mqtt_component import Component2MQTT, handle_pattern
-from config import mqtt_credentials
+from common.kettler import KettlerStatus
+from common.mqtt_component import Component2MQTT, DecodeError, handle_pattern
+from config import mqtt_credentials, mqtt_publish
 from controller.gpx import GPXController
 from controller.komoot import KomootController
 from controller.antplus import ANTController
-import json
 
 
 class ControllerManager2MQTT(Component2MQTT):
-    def __init__(self, mqtt):
-        super().__init__(mqtt)
+    def __init__(self, mqtt, publish_policy=None):
+        super().__init__(mqtt, publish_policy)
 
         self.track_mode = None
 
@@ -34,34 +34,48 @@ class ControllerManager2MQTT(Component2MQTT):
         for controller in self.controllers.values():
             await controller.init_state()
 
+    async def on_cancel(self):
+        for controller in self.controllers.values():
+            await controller.close()
+        await self.ant.close()
+
     @handle_pattern(topic_pattern="controller/cmnd/+")
     async def handle_command_messages(self, messages):
         async for message in messages:
             action = message.topic.split("/")[-1]
             if action == "track":
                 try:
-                    data = json.loads(message.payload.decode())
+                    data = self.decode_message(message)
                     if 'trackMode' in data:
                         controller = self.controllers.get(data['trackMode'])
                         if await controller.load_track(data):
                             self.track_mode = data['trackMode']
                             await self.update_mqtt("controller/trackMode", self.track_mode)
                             await self.send_command("kettler/cmnd/reset", '')
-                except json.JSONDecodeError:
+                except DecodeError:
                     pass
             else:
                 controller = self.controllers.get(self.track_mode)
                 if controller is not None:
                     await controller.handle_command_message(message)
 
-    @handle_pattern(topic_pattern="kettler/data")
+    @handle_pattern(topic_pattern="kettler/data", schema=KettlerStatus)
     async def handle_kettler_messages(self, messages):
         async for message in messages:
             controller = self.controllers.get(self.track_mode)
             if controller is not None:
-                await controller.handle_kettler_message(message)
+                await controller.handle_kettler_message(message.payload)
 
-            await self.ant.handle_kettler_message(message)
+            await self.ant.handle_kettler_message(message.payload)
+
+    @handle_pattern(topic_pattern="heartrate/data")
+    async def handle_heartrate_messages(self, messages):
+        async for message in messages:
+            try:
+                data = self.decode_message(message)
+                await self.ant.handle_heartrate_message(data['payload'])
+            except (DecodeError, KeyError):
+                pass
 
     async def ant_power(self, power):
         # auto enable ant controller, if no other controller is active
@@ -73,7 +87,7 @@ class ControllerManager2MQTT(Component2MQTT):
 
 
 async def main():
-    mqtt_server = ControllerManager2MQTT(mqtt_credentials)
+    mqtt_server = ControllerManager2MQTT(mqtt_credentials, mqtt_publish)
     await asyncio.gather(mqtt_server.mqtt_connect(will_topic="controller"))
 
 
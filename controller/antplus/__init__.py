@@ -1,72 +1,157 @@
 import asyncio
+import dataclasses
+import time
 
+from asyncio_mqtt import MqttError
 from ant.core.exceptions import ANTException
 from ant.core.node import Node, Network
 from ant.core.constants import NETWORK_KEY_ANT_PLUS, NETWORK_NUMBER_PUBLIC
 from ant.core.driver import USB2Driver
-from common.fitness_equipment_controls import FitnessEquipmentControls
+from common.ant_profiles import BicyclePower, SpeedCadence, HeartRate
+from common.ant_transmitter import ANTTransmitter
+from common.fitness_equipment_controls import FitnessEquipmentControls, FitnessEquipmentData
 from config import antplus, power
-import json
 
 
 class ANTController:
+    STATISTICS_INTERVAL = 10
+
+    # broadcast only profiles, see antplus['profiles']
+    PROFILES = {
+        'power': BicyclePower,
+        'speed_cadence': SpeedCadence,
+        'heartrate': HeartRate
+    }
+
     def __init__(self, manager):
         self.manager = manager
+        self.profiles = []
+        self.data = FitnessEquipmentData()
+        self.loop = asyncio.get_running_loop()
+
+        # latest target power per control page, filled from the ANT driver thread
+        self.controls = dict()
+        self.controls_pending = asyncio.Event()
+
         self.task = asyncio.create_task(self.ant_task())
-        self.fitness_equipment = None
-        self.loop = None
+        self.control_task = asyncio.create_task(self.process_controls())
 
     async def ant_task(self):
-        self.loop = asyncio.get_event_loop()
-
         while True:
             driver = USB2Driver(idVendor=antplus['vendor_id'], idProduct=antplus['product_id'])
             antnode = Node(driver)
+            transmitter = None
             try:
                 antnode.start()
                 network = Network(key=NETWORK_KEY_ANT_PLUS, name='N:ANT+')
                 antnode.setNetworkKey(NETWORK_NUMBER_PUBLIC, network)
 
-                self.fitness_equipment = FitnessEquipmentControls(antnode, antplus['sensor_id'], callbacks={
-                    'basic_resistance': lambda basic_resistance:
-                    self.update_power(int(power['resistance'](basic_resistance / 1000))),
-                    'target_power': lambda target_power:
-                    self.update_power(int(target_power / 100)),
-                    'track_resistance': lambda grade, coefficient:
-                    self.update_power(int(power['grade'](grade / 10000))),
-                    'wind_resistance': lambda **kwargs: print("[wind resistance]", kwargs)
-                })
-                self.fitness_equipment.open()
+                # all profiles share one channel each on the stick and are broadcast by one transmitter thread
+                transmitter = ANTTransmitter()
+                profiles = []
+                for name in antplus['profiles']:
+                    if name == 'fec':
+                        profile = FitnessEquipmentControls(antnode, antplus['sensor_id'], callbacks={
+                            'basic_resistance': lambda basic_resistance:
+                            self.update_power('basic_resistance', int(power['resistance'](basic_resistance / 1000))),
+                            'target_power': lambda target_power:
+                            self.update_power('target_power', int(target_power / 100)),
+                            'track_resistance': lambda grade, coefficient:
+                            self.update_power('track_resistance', int(power['grade'](grade / 10000))),
+                            'wind_resistance': lambda **kwargs: print("[wind resistance]", kwargs)
+                        })
+                    else:
+                        profile = self.PROFILES[name](antnode, antplus['sensor_id'])
 
-                print(f"[ANT+] Started fitness equipment controller with ANT+ ID {antplus['sensor_id']}")
+                    profile.data = self.data
+                    profile.open()
+                    transmitter.add(name, profile)
+                    profiles.append(profile)
 
-                while not driver.disconnected.is_set():
+                self.profiles = profiles
+                transmitter.start()
+
+                print(f"[ANT+] Started {', '.join(antplus['profiles'])} with ANT+ ID {antplus['sensor_id']}")
+
+                last_statistics = time.monotonic()
+                while not driver.disconnected.is_set() and transmitter.is_alive():
                     try:
-                        self.fitness_equipment.update()
-                        await asyncio.sleep(0.25)
+                        await asyncio.sleep(1)
                     except asyncio.CancelledError:
                         print(f'[ANT+] Disconnected.')
                         return
+
+                    if time.monotonic() - last_statistics >= self.STATISTICS_INTERVAL:
+                        last_statistics = time.monotonic()
+                        # broadcasting goes on while the broker is unreachable
+                        try:
+                            await self.manager.update_mqtt("controller/antplus", transmitter.get_statistics())
+                        except MqttError as e:
+                            print(f'[ANT+] Could not publish statistics: {str(e)}')
+
+                if transmitter.error is not None:
+                    print(f'[ANT+] Transmitter stopped: {repr(transmitter.error)}')
             except ANTException as err:
                 print(f'[ANT+] ANT Exception: {err}')
             finally:
+                self.profiles = []
+                if transmitter is not None and transmitter.is_alive():
+                    transmitter.stop()
+                    transmitter.join(1)
                 antnode.stop()
                 await asyncio.sleep(2)
 
-    async def handle_kettler_message(self, message):
+    async def close(self):
+        await self.manager.cancel_task(self.control_task)
+        await self.manager.cancel_task(self.task)
+
+    def update_data(self, **changes):
+        # hand over a new object, the transmitter thread must never see a partial update
+        self.data = dataclasses.replace(self.data, **changes)
+        for profile in self.profiles:
+            profile.data = self.data
+
+    async def handle_kettler_message(self, status):
         try:
-            data = json.loads(message.payload.decode())
-            minutes, seconds = data['payload']['timeElapsed'].split(":", 2)
-            self.fitness_equipment.data.time_elapsed = (int(minutes) * 60 + int(seconds)) * 4
-            self.fitness_equipment.data.speed = int(data['payload']['speed'] * 1000 / 3.6)
-            self.fitness_equipment.data.resistance = int(data['payload']['realPower'] / 1200)
-            self.fitness_equipment.data.instant_cadence = data['payload']['cadence']
-            self.fitness_equipment.data.instant_power = data['payload']['realPower']
-
-        except json.JSONDecodeError:
+            minutes, seconds = status.time_elapsed.split(":", 2)
+            time_elapsed = (int(minutes) * 60 + int(seconds)) * 4
+        except ValueError:
+            time_elapsed = self.data.time_elapsed
+
+        self.update_data(time_elapsed=time_elapsed,
+                         speed=int(status.speed * 1000 / 3.6),
+                         resistance=int(status.real_power / 1200),
+                         instant_cadence=status.cadence,
+                         instant_power=status.real_power)
+
+    async def handle_heartrate_message(self, data):
+        # the heartrate service publishes an empty object when the device disconnects
+        self.update_data(instant_heartrate=data.get('hr'))
+
+    def update_power(self, control, watts):
+        # called from the ANT driver thread
+        try:
+            self.loop.call_soon_threadsafe(self.queue_power, control, watts)
+        except RuntimeError:
+            # event loop has been closed
             pass
 
-    def update_power(self, watts):
-        self.loop.create_task(self.manager.ant_power(power['minmax'](value=watts,
-                                                                     lower=power['lower_limit'],
-                                                                     upper=power['upper_limit'])))
+    def queue_power(self, control, watts):
+        # bursts of control pages are coalesced to the latest value of each page until the consumer runs
+        self.controls.pop(control, None)
+        self.controls[control] = watts
+        self.controls_pending.set()
+
+    async def process_controls(self):
+        while True:
+            await self.controls_pending.wait()
+            self.controls_pending.clear()
+
+            controls, self.controls = self.controls, dict()
+            for watts in controls.values():
+                try:
+                    await self.manager.ant_power(power['minmax'](value=watts,
+                                                                 lower=power['lower_limit'],
+                                                                 upper=power['upper_limit']))
+                except MqttError as e:
+                    print(f'[ANT+] Could not send target power: {str(e)}')
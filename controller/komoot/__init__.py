@@ -1,48 +1,78 @@
-import json
-from config import power, komoot
-from common.komoot_reader import KomootTour
+import asyncio
+import aiohttp
+from config import grade, power, komoot
+from common.komoot_cache import KomootCache
+from common.komoot_client import KomootClient
 
 
 class KomootController:
     def __init__(self, manager):
         self.manager = manager
         self.selected_track = None
-        self.tracks = self.load_tracks()
+        self.active_highlight = None
+        self.client = KomootClient(cache=KomootCache(path=komoot['cache_path'],
+                                                     max_size=komoot['cache_size'],
+                                                     max_age=komoot['cache_max_age'],
+                                                     offline=komoot['offline']),
+                                   api_url=komoot['api_url'],
+                                   web_api_url=komoot['web_api_url'])
+        self.tracks = []
+        self.tracks_task = None
 
-    @staticmethod
-    def load_tracks():
-        return KomootTour.getTours(user_id=komoot['user_id'])
+    async def load_tracks(self):
+        try:
+            return await self.client.get_tours(user_id=komoot['user_id'])
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as e:
+            print(f"[Komoot] Could not load tours: {str(e)}")
+            return self.tracks
 
     async def init_state(self):
+        # the tour list is loaded in the background, the manager subscribes to its topics after on_connect
+        await self.manager.update_mqtt("controller/tracks/komoot", self.tracks)
+        if self.tracks_task is not None:
+            self.tracks_task.cancel()
+        self.tracks_task = asyncio.create_task(self.update_tracks())
+
+    async def update_tracks(self):
+        self.tracks = await self.load_tracks()
         await self.manager.update_mqtt("controller/tracks/komoot", self.tracks)
 
+    async def close(self):
+        if self.tracks_task is not None:
+            self.tracks_task.cancel()
+            self.tracks_task = None
+        await self.client.close()
+
     async def load_track(self, track):
         try:
             selected = self.tracks[int(track['trackIdx'])]
-            self.selected_track = KomootTour(tour_id=selected['tour_id'])
+            self.selected_track = await self.client.get_tour(tour_id=selected['tour_id'])
+            self.selected_track.resample_grades(**grade)
+            self.active_highlight = None
+            await self.manager.update_mqtt("controller/highlight", None)
             await self.manager.update_mqtt("controller/track", self.selected_track.get_info())
             await self.manager.send_command("logger/cmnd/start", '{"logLocation": true}')
             return True
-        except (IndexError, ValueError, KeyError) as e:
+        except (IndexError, ValueError, KeyError, aiohttp.ClientError, asyncio.TimeoutError) as e:
             await self.manager.update_mqtt("controller/track", {"error": str(e)})
             return False
 
     async def handle_command_message(self, message):
         pass
 
-    async def handle_kettler_message(self, message):
-        try:
-            data = json.loads(message.payload.decode())
-            info = self.selected_track.get_info_at_distance(data['payload']['calcDistance'])
-            highlight = self.selected_track.get_highlight_at_distance(data['payload']['calcDistance'])
+    async def handle_kettler_message(self, status):
+        info = self.selected_track.get_info_at_distance(status.calc_distance)
+        highlight = self.selected_track.get_highlight_at_distance(status.calc_distance)
+
+        await self.manager.update_mqtt("controller/location", info, precise_timestamps=True)
 
-            await self.manager.update_mqtt("controller/location", info)
+        # only publish when the active highlight changes
+        if highlight is not self.active_highlight:
+            self.active_highlight = highlight
             await self.manager.update_mqtt("controller/highlight", highlight)
-            await self.manager.send_command("kettler/cmnd/power", int(power['grade'](info.grade)))
-
-            if info.progress >= 1:
-                await self.manager.send_command("logger/cmnd/stop", '')
-                await self.manager.clear_topic("controller/location")
-                await self.manager.clear_track_mode()
-        except json.JSONDecodeError:
-            pass
\ No newline at end of file
+        await self.manager.send_command("kettler/cmnd/power", int(power['grade'](info.grade)))
+
+        if info.progress >= 1:
+            await self.manager.send_command("logger/cmnd/stop", '')
+            await self.manager.clear_topic("controller/location")
+            await self.manager.clear_track_mode()
\ No newline at end of file
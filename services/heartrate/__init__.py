@@ -1,35 +1,78 @@
 import asyncio
 import os
+from common.heartrate import HRVEngine, parse_heart_rate_measurement
 from common.mqtt_component import Component2MQTT
-from config import mqtt_credentials, heartrate
-from bleak import BleakClient, BleakError
+from config import mqtt_credentials, mqtt_publish, heartrate
+from bleak import BleakClient, BleakError, BleakScanner
 import bleak_sigspec.utils
-import struct
+
+
+class HeartrateDevice:
+    def __init__(self, name, mac, legacy=False):
+        self.name = name
+        self.mac = mac
+        # the first device is also published on the heartrate/... topics of the single device service
+        self.legacy = legacy
+        self.hrv = HRVEngine(window=heartrate['hrv_window'], min_beats=heartrate['hrv_min_beats'])
+
 
 class Heartrate2MQTT(Component2MQTT):
+    def __init__(self, mqtt, publish_policy=None):
+        super().__init__(mqtt, publish_policy)
+
+        self.devices = [HeartrateDevice(device['name'], device['mac'], legacy=i == 0)
+                        for i, device in enumerate(heartrate['devices'])]
+
     async def on_connect(self):
-        await self.update_mqtt("heartrate/connected", False)
-        await self.update_mqtt("heartrate/data", {})
-        await self.update_mqtt("heartrate/location", {})
+        for device in self.devices:
+            await self.publish_device(device, "connected", False)
+            await self.publish_device(device, "data", {})
+            await self.publish_device(device, "location", {})
+            await self.publish_device(device, "hrv", {})
+
+    async def publish_device(self, device, key, data, precise_timestamps=False):
+        await self.update_mqtt(f"heartrate/{device.name}/{key}", data, precise_timestamps)
+        if device.legacy:
+            await self.update_mqtt(f"heartrate/{key}", data, precise_timestamps)
+
+    async def publish_hrv(self):
+        while True:
+            await asyncio.sleep(heartrate['hrv_interval'])
+            for device in self.devices:
+                if len(device.hrv.beats):
+                    await self.publish_device(device, "hrv", device.hrv.get_info())
 
     async def listen_heartrate(self):
-        device_mac = heartrate['macs'][0]
+        # one scan for all devices, devices which are not found are connected by their address
+        try:
+            found = await BleakScanner.discover(timeout=heartrate['scan_timeout'], adapter=heartrate['adapter'])
+        except BleakError as e:
+            print(f"[Bluetooth] Scan failed - {str(e)}")
+            found = []
+        found = dict((ble_device.address.upper(), ble_device) for ble_device in found)
+
+        await asyncio.gather(*[self.listen_device(device, found.get(device.mac.upper(), device.mac))
+                               for device in self.devices])
+
+    async def listen_device(self, device, address):
+        backoff = heartrate['reconnect_min']
 
         while True:
             try:
                 disconnect_event = asyncio.Event()
 
                 def disconnect_handler(c):
-                    print(f"[Bluetooth] Disconnected {c.is_connected}")
+                    print(f"[Bluetooth] {device.name} disconnected {c.is_connected}")
                     disconnect_event.set()
 
                 try:
-                    async with BleakClient(device_mac,
+                    async with BleakClient(address,
                                            timeout=30,
                                            adapter=heartrate['adapter'],
                                            disconnected_callback=disconnect_handler) as client:
-                        print(f"[Bluetooth] Connected {client.is_connected}")
-                        await self.update_mqtt("heartrate/connected", True)
+                        print(f"[Bluetooth] {device.name} connected {client.is_connected}")
+                        backoff = heartrate['reconnect_min']
+                        await self.publish_device(device, "connected", True)
                         await client.get_services()
 
                         heart_rate_service = None
@@ -37,6 +80,11 @@ class Heartrate2MQTT(Component2MQTT):
                             if service.uuid.startswith('0000180d'):
                                 heart_rate_service = service
 
+                        if heart_rate_service is None:
+                            print(f"[Bluetooth] {device.name} has no heart rate service, skipped")
+                            await self.publish_device(device, "connected", False)
+                            return
+
                         characteristic_heart_rate_measurement = None
                         characteristic_body_sensor_location = None
                         for characteristic in heart_rate_service.characteristics:
@@ -49,50 +97,47 @@ class Heartrate2MQTT(Component2MQTT):
                         body_sensor_location_data = await client.read_gatt_char(characteristic_body_sensor_location)
                         body_sensor_location = bleak_sigspec.utils.get_char_value(body_sensor_location_data,
                                                                                   "body_sensor_location")
-                        print("Sensor location: %s" % str(body_sensor_location))
-                        await self.update_mqtt("heartrate/location", body_sensor_location)
+                        print(f"[Bluetooth] {device.name} sensor location: {str(body_sensor_location)}")
+                        await self.publish_device(device, "location", body_sensor_location)
 
                         async def callback(_, data):
                             try:
-                                value = bleak_sigspec.utils.get_char_value(data, "heart_rate_measurement")
-                            except struct.error:
-                                print(f"Struct error {str(data)}")
+                                hr, rris = parse_heart_rate_measurement(data)
+                            except ValueError as e:
+                                print(f"Could not parse Heart Rate Data {str(e)}")
                                 return
 
-                            try:
-                                if 'RR-Interval' in value:
-                                    await self.update_mqtt('heartrate/data',
-                                                     {'hr': value['Heart Rate Measurement Value (uint8)']['Value'],
-                                                     'rri': value['RR-Interval']['RR-Interval']['RR-I0']['Value']})
-                                    print(value['Heart Rate Measurement Value (uint8)']['Value'],
-                                          value['RR-Interval']['RR-Interval']['RR-I0']['Value'])
-                                else:
-                                    await self.update_mqtt('heartrate/data',
-                                                     {'hr': value['Heart Rate Measurement Value (uint8)']['Value'],
-                                                     'rri': None})
-                                    print(value['Heart Rate Measurement Value (uint8)']['Value'])
-                            except KeyError:
-                                print(f"Could not parse Heart Rate Data {str(value)}")
-                                return
+                            # notifications can hold several RR intervals, rri is the first one of them
+                            for rri in rris:
+                                device.hrv.add(rri)
+                            await self.publish_device(device, "data",
+                                                      {'hr': hr, 'rri': rris[0] if len(rris) else None, 'rris': rris},
+                                                      precise_timestamps=True)
 
                         await client.start_notify(characteristic_heart_rate_measurement, callback)
                         try:
                             await disconnect_event.wait()
-                            await self.update_mqtt("heartrate/connected", False)
-                            await self.update_mqtt("heartrate/data", {})
-                            await self.update_mqtt("heartrate/location", {})
+                            await self.publish_device(device, "connected", False)
+                            await self.publish_device(device, "data", {})
+                            await self.publish_device(device, "location", {})
+                            await self.publish_device(device, "hrv", {})
+                            device.hrv.reset()
                         except asyncio.CancelledError:
                             await client.stop_notify(characteristic_heart_rate_measurement)
                             return
                 except asyncio.CancelledError:
                     return
-            except (asyncio.TimeoutError, BleakError) as e:
-                print(f"[Bluetooth] Error - {str(e)}")
-                print("Retrying...")
+            except Exception as e:
+                # errors of one device must not stop the others
+                print(f"[Bluetooth] {device.name} error - {repr(e)}")
+                print(f"Retrying in {backoff}s...")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, heartrate['reconnect_max'])
 
 async def main():
-    mqtt_server = Heartrate2MQTT(mqtt_credentials)
-    await asyncio.gather(mqtt_server.mqtt_connect(will_topic="heartrate"), mqtt_server.listen_heartrate())
+    mqtt_server = Heartrate2MQTT(mqtt_credentials, mqtt_publish)
+    await asyncio.gather(mqtt_server.mqtt_connect(will_topic="heartrate"), mqtt_server.listen_heartrate(),
+                         mqtt_server.publish_hrv())
 
 def run():
     # Change to the "Selector" event loop for Windows
@@ -106,4 +151,3 @@ def run():
 
 if __name__ == '__main__':
     run()
-
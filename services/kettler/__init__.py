@@ -1,16 +1,19 @@
 import asyncio
 import os
 import time
-from config import mqtt_credentials, kettler
-from common.kettler import Kettler
+from config import mqtt_credentials, mqtt_publish, kettler
+from common.kettler import Kettler, PowerControl
+from common.odometry import Odometer
 from common.mqtt_component import Component2MQTT, handle_pattern
 
 class Kettler2MQTT(Component2MQTT):
-    def __init__(self, mqtt):
-        super().__init__(mqtt)
+    SERIAL_STATISTICS_INTERVAL = 10
+
+    def __init__(self, mqtt, publish_policy=None):
+        super().__init__(mqtt, publish_policy)
 
         self.kettler = None
-        self.dist = None
+        self.odometer = Odometer()
         self.target_power = 100
 
         self.task = asyncio.create_task(self.kettler_task())
@@ -29,6 +32,13 @@ class Kettler2MQTT(Component2MQTT):
             except (IndexError, ValueError):
                 pass
 
+    async def close_kettler(self):
+        try:
+            if self.kettler is not None:
+                await self.kettler.close()
+        except IOError:
+            pass
+
     async def kettler_task(self):
         while True:
             try:
@@ -38,52 +48,55 @@ class Kettler2MQTT(Component2MQTT):
                 print("[Kettler] Bike %s" % await self.kettler.getId())
 
                 await self.kettler.reset()
-                await asyncio.sleep(0.2)
                 await self.kettler.changeMode()
-                await asyncio.sleep(0.2)
 
                 # init state
-                self.dist = 0
-                last_status_timestamp = round(time.monotonic() * 1000)
-                last_status_message = None
+                control = PowerControl(mode_change_after=kettler['mode_change_after'],
+                                       mode_change_cooldown=kettler['mode_change_cooldown'])
+                self.odometer.reset()
+                last_statistics = time.monotonic()
 
                 while True:
+                    # commands are paced by the protocol engine, statuses are published as soon as they arrive
                     temp_power = self.target_power - self.target_power % 5
-                    status = await self.kettler.setPower(temp_power)
-
-                    await asyncio.sleep(0.2)
+                    if control.needs_power(temp_power):
+                        status = await self.kettler.setPower(temp_power)
+                        control.sent(temp_power)
+                    else:
+                        status = await self.kettler.readStatus()
+                    # monotonic time the response has been read
+                    received = self.kettler.last_response
+
+                    if time.monotonic() - last_statistics >= self.SERIAL_STATISTICS_INTERVAL:
+                        await self.update_mqtt("kettler/serial", self.kettler.get_statistics())
+                        last_statistics = time.monotonic()
 
                     if status is not None:
-                        if status['destPower'] != temp_power:
-                           await self.kettler.changeMode()
-                           await asyncio.sleep(0.2)
-
-                        time_elapsed = time.monotonic() - last_status_timestamp
-                        last_status_timestamp = time.monotonic()
+                        if control.needs_mode_change(status.dest_power):
+                            await self.kettler.changeMode()
 
-                        if status['speed'] > 0:
-                            speed = status['speed'] / 3.6
-                            self.dist += speed * time_elapsed
+                        # raw bike status with the integrated distance in m, both stamped with the receive time
+                        status.calc_distance = round(self.odometer.add(status.speed / 3.6, received), 2)
 
-                        status['calcDistance'] = int(self.dist)
-
-                        if status != last_status_message:
-                            await self.update_mqtt("kettler/data", status, precise_timestamps=True)
-                            last_status_message = status
+                        # unchanged statuses are dropped or refreshed by the publish policy of kettler/data
+                        await self.update_mqtt("kettler/data", status,
+                                               timestamp=time.time() - (time.monotonic() - received))
             except IOError:
                 print("[Kettler] IO Error. Reconnecting...")
-                try:
-                    await self.kettler.close()
-                except IOError:
-                    pass
+                await self.close_kettler()
+                await asyncio.sleep(2)
+            except Exception as e:
+                print(f"[Kettler] Error: {repr(e)}. Reconnecting...")
+                await self.close_kettler()
                 await asyncio.sleep(2)
             except asyncio.CancelledError:
-                await asyncio.sleep(0.2)
+                if self.kettler is not None:
+                    await self.kettler.close()
                 print("[Kettler] Disconnected")
                 return
 
 async def main():
-    mqtt_server = Kettler2MQTT(mqtt_credentials)
+    mqtt_server = Kettler2MQTT(mqtt_credentials, mqtt_publish)
     await asyncio.gather(mqtt_server.mqtt_connect(will_topic="kettler"))
 
 def run():
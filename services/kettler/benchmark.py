@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import json
+import time
+from asyncio_mqtt import Client
+from config import mqtt_credentials, mqtt_publish, kettler
+from services.kettler import Kettler2MQTT
+from services.kettler.emulator import KettlerEmulator
+
+
+class BenchmarkKettler2MQTT(Kettler2MQTT):
+    """Kettler2MQTT that records the kettler/data messages it publishes."""
+
+    def __init__(self, mqtt, publish_policy, received):
+        self.received = received
+        super().__init__(mqtt, publish_policy)
+
+    async def send(self, state, payload, encode, retain):
+        await super().send(state, payload, encode, retain)
+        for topic, message in encode():
+            if topic == "kettler/data":
+                self.received(message)
+
+
+class Benchmark:
+    """Measures the kettler/data publish rate and the latency from the bike's response to the published message."""
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self.latencies = []
+        self.unmatched = 0
+        self.statistics = None
+
+    def received(self, message):
+        received = time.time()
+        payload = json.loads(message)['payload']
+
+        key = (payload['cadence'], round(payload['speed'] * 10), round(payload['distance'] * 10),
+               payload['destPower'], payload['energy'], payload['timeElapsed'], payload['realPower'])
+        sent = self.emulator.sent.get(key)
+        if sent is None:
+            self.unmatched += 1
+        else:
+            self.latencies.append(received - sent)
+
+    def report(self, duration):
+        commands = dict(self.emulator.commands)
+        statuses = commands.get("ST", 0) + commands.get("PW", 0)
+        print("[Benchmark] Commands:  %s" % commands)
+        print("[Benchmark] Statuses:  %.1f/s" % (statuses / duration))
+        print("[Benchmark] Published: %.1f/s (%d unmatched)" % ((len(self.latencies) + self.unmatched) / duration,
+                                                               self.unmatched))
+
+        if len(self.latencies):
+            latencies = sorted(self.latencies)
+            print("[Benchmark] Latency:   p50 %.1f ms, p95 %.1f ms, max %.1f ms" % (
+                latencies[len(latencies) // 2] * 1000,
+                latencies[int(len(latencies) * 0.95)] * 1000,
+                latencies[-1] * 1000))
+
+        if self.statistics is not None:
+            print("[Benchmark] Serial:    %s" % self.statistics)
+
+
+async def subscribe(benchmark):
+    async with Client(mqtt_credentials['server'], port=mqtt_credentials['port']) as client:
+        async with client.filtered_messages(f"{mqtt_credentials['base_topic']}/kettler/+") as messages:
+            await client.subscribe(f"{mqtt_credentials['base_topic']}/kettler/+")
+            async for message in messages:
+                if message.topic.endswith("/kettler/data") and len(message.payload):
+                    benchmark.received(message.payload.decode("utf-8"))
+                elif message.topic.endswith("/kettler/serial"):
+                    benchmark.statistics = json.loads(message.payload.decode("utf-8"))['payload']
+
+
+async def main(args):
+    emulator = KettlerEmulator(latency=args.latency, jitter=args.jitter, replay=args.replay).start()
+    benchmark = Benchmark(emulator)
+
+    # the service reads the port from the config when it connects
+    kettler['port'] = emulator.port
+    print(f"[Benchmark] Kettler emulator on {emulator.port}, running for {args.duration} s")
+
+    if args.broker:
+        # end-to-end through the broker
+        mqtt_server = Kettler2MQTT(mqtt_credentials, mqtt_publish)
+        tasks = [asyncio.create_task(subscribe(benchmark)),
+                 asyncio.create_task(mqtt_server.mqtt_connect(will_topic="kettler"))]
+    else:
+        # up to the MQTT client, no broker needed
+        mqtt_server = BenchmarkKettler2MQTT(mqtt_credentials, mqtt_publish, benchmark.received)
+        tasks = []
+
+    started = time.monotonic()
+    await asyncio.sleep(args.duration)
+    duration = time.monotonic() - started
+
+    if not args.broker:
+        benchmark.statistics = mqtt_server.kettler.get_statistics()
+
+    for task in tasks + [mqtt_server.task]:
+        await mqtt_server.cancel_task(task)
+    emulator.stop()
+
+    benchmark.report(duration)
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmark Kettler2MQTT against the Kettler emulator")
+    parser.add_argument("--duration", type=float, default=30, help="duration of the benchmark in s")
+    parser.add_argument("--latency", type=float, default=0.05, help="response latency of the bike in s")
+    parser.add_argument("--jitter", type=float, default=0.0, help="additional random latency of the bike in s")
+    parser.add_argument("--replay", help="file with recorded status lines")
+    parser.add_argument("--broker", action="store_true", help="publish through the MQTT broker from config.py")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        print("Goodbye...")
+
+
+if __name__ == '__main__':
+    run()
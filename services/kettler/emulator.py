@@ -0,0 +1,187 @@
+import argparse
+import collections
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+
+class KettlerEmulator:
+    """Kettler bike on a pseudo terminal.
+
+    Answers ID, CM, RS, ST and PW like the bike after `latency` (+ up to `jitter`) seconds and at the
+    transfer rate of the serial line. Statuses are simulated from the target power, or replayed from a
+    recorded status stream (one status line per line, e.g. `000 052 095 000 030 0001 00:12 030`) with the
+    target power replaced by the last PW.
+    """
+
+    ID = "SX2"
+    ACK = "ACK"
+
+    def __init__(self, latency=0.05, jitter=0.0, baudrate=9600, replay=None, cadence=80):
+        self.latency = latency
+        self.jitter = jitter
+        self.baudrate = baudrate
+        self.cadence = cadence
+
+        self.replay = None
+        if replay is not None:
+            with open(replay, 'r', encoding="utf-8") as f:
+                self.replay = [line.split() for line in f if len(line.split()) == 8 and not line.startswith("#")]
+            if len(self.replay) == 0:
+                raise ValueError(f"No status lines in {replay}")
+        self.replay_index = 0
+
+        # simulated bike
+        self.power = 25
+        self.real_power = 25.0
+        self.distance = 0.0
+        self.energy = 0.0
+        self.started = None
+        self.updated = None
+
+        # write time of the latest status lines, see status_key()
+        self.sent = collections.OrderedDict()
+        self.commands = collections.Counter()
+
+        self.master, self.slave = os.openpty()
+        # no echo and no line translation before the port is opened
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.started = self.updated = time.monotonic()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="KettlerEmulator", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        os.close(self.master)
+        os.close(self.slave)
+
+    def run(self):
+        buffer = b""
+        while self.running:
+            readable, _, _ = select.select([self.master], [], [], 0.1)
+            if not readable:
+                continue
+
+            try:
+                buffer += os.read(self.master, 1024)
+            except OSError:
+                return
+
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                response = self.handle(line.decode("ascii", errors="replace").strip())
+                if response is not None:
+                    self.respond(response)
+
+    def handle(self, line):
+        segments = line.split()
+        if len(segments) == 0:
+            return None
+
+        command = segments[0]
+        self.commands[command] += 1
+
+        if command == "ID":
+            return self.ID
+        elif command in ("CM", "RS"):
+            return self.ACK
+        elif command == "ST":
+            return self.status()
+        elif command == "PW" and len(segments) == 2 and segments[1].isdigit():
+            self.power = int(segments[1])
+            return self.status()
+
+        # the bike does not answer unknown commands
+        return None
+
+    def respond(self, response):
+        data = (response + "\r\n").encode("ascii")
+
+        # 10 bits per byte on the serial line
+        time.sleep(self.latency + random.uniform(0, self.jitter) + len(data) * 10 / self.baudrate)
+
+        if response not in (self.ID, self.ACK):
+            key = self.status_key(response)
+            self.sent[key] = time.time()
+            self.sent.move_to_end(key)
+            while len(self.sent) > 1000:
+                self.sent.popitem(last=False)
+
+        os.write(self.master, data)
+
+    def status(self):
+        if self.replay is not None:
+            segments = list(self.replay[self.replay_index])
+            self.replay_index = (self.replay_index + 1) % len(self.replay)
+            segments[4] = "%03d" % self.power
+            return " ".join(segments)
+
+        now = time.monotonic()
+        dt = now - self.updated
+        self.updated = now
+
+        # the bike approaches the target power within a few seconds
+        self.real_power += (self.power - self.real_power) * min(1.0, dt)
+        cadence = self.cadence + random.randint(-2, 2)
+        speed = cadence * 0.4
+        self.distance += speed / 3.6 * dt
+        self.energy += self.real_power * dt / 1000
+
+        elapsed = int(now - self.started)
+        return "000 %03d %03d %03d %03d %04d %02d:%02d %03d" % (cadence, round(speed * 10), int(self.distance / 100),
+                                                               self.power, int(self.energy),
+                                                               elapsed // 60 % 100, elapsed % 60,
+                                                               round(self.real_power))
+
+    @staticmethod
+    def status_key(status_line):
+        # cadence speed distance destPower energy timeElapsed realPower, independent of padding
+        segments = status_line.split()
+        return tuple(segment if i == 6 else int(segment) for i, segment in enumerate(segments) if i > 0)
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Emulate a Kettler bike on a pseudo terminal")
+    parser.add_argument("--latency", type=float, default=0.05, help="response latency in s")
+    parser.add_argument("--jitter", type=float, default=0.0, help="additional random latency in s")
+    parser.add_argument("--replay", help="file with recorded status lines")
+    parser.add_argument("--link", help="create a symlink to the pseudo terminal, e.g. /tmp/kettler")
+    args = parser.parse_args()
+
+    emulator = KettlerEmulator(latency=args.latency, jitter=args.jitter, replay=args.replay).start()
+    port = emulator.port
+    if args.link is not None:
+        if os.path.islink(args.link):
+            os.remove(args.link)
+        os.symlink(emulator.port, args.link)
+        port = args.link
+    print(f"[Emulator] Kettler on {port}")
+
+    try:
+        while True:
+            time.sleep(10)
+            print("[Emulator] Commands: %s" % dict(emulator.commands))
+    except KeyboardInterrupt:
+        print("Goodbye...")
+    finally:
+        emulator.stop()
+        if args.link is not None and os.path.islink(args.link):
+            os.remove(args.link)
+
+
+if __name__ == '__main__':
+    run()
@@ -1,48 +1,52 @@
 import asyncio
-import json
+import concurrent.futures
+import multiprocessing
 import os
-from config import mqtt_credentials, logger as logger_config
+import struct
+import time
+from config import mqtt_credentials, mqtt_publish, logger as logger_config
 from datetime import datetime
-import csv
-import dataclasses
-from typing import IO
-from common.mqtt_component import Component2MQTT, handle_pattern
-
-@dataclasses.dataclass
-class CSVWriter:
-    filename: str
-    handle: IO[str]
-    writer: csv.DictWriter
-
-
-@dataclasses.dataclass
-class LogDatapoint:
-    timestamp: int = None
-    speed: float = None
-    cadence: int = None
-    power: int = None
-    distance: float = None
-
-    position_lat: float = None
-    position_long: float = None
-    altitude: float = None
-    grade: float = None
-
-    heart_rate: int = None
-    rri: float = None
+from common.kettler import KettlerStatus
+from common.log_export import export_session
+from common.log_writer import FORMATS, SINKS, LogRecord, LogWriter, recover_logs
+from common.mqtt_component import Component2MQTT, DecodeError, handle_pattern
+from common.sensor_fusion import FusionStream, SensorFusion
+from common.track import DistanceTrackInfo
 
 class MQTT2Log(Component2MQTT):
-    def __init__(self, mqtt):
-        super().__init__(mqtt)
+    def __init__(self, mqtt, publish_policy=None):
+        super().__init__(mqtt, publish_policy)
 
-        self.csv = None
+        self.log = None
+        self.filename = None
         self.log_location = False
-        self.log_heartrate = False
-        self.datapoint = LogDatapoint()
+        self.exporter = None
+        self.export_tasks = set()
+        self.fusion_task = None
+
+        # samples of each sensor, rows are written at a fixed rate from their values at the same time
+        max_age = logger_config['max_age']
+        self.fusion = SensorFusion({
+            'kettler': FusionStream(('speed', 'cadence', 'power', 'distance'), max_age['kettler'],
+                                    interpolate=('speed', 'distance')),
+            'heartrate': FusionStream(('heart_rate', 'rri'), max_age['heartrate']),
+            'location': FusionStream(('position_lat', 'position_long', 'altitude', 'grade'), max_age['location'],
+                                     interpolate=('position_lat', 'position_long', 'altitude', 'grade'))
+        }, primary='kettler', rate=logger_config['rate'], delay=logger_config['delay'])
+
+        recover_logs(logger_config['path'])
 
     async def on_connect(self):
         await self.update_mqtt("logger/data", {"status": "ready"})
 
+    async def on_cancel(self):
+        await self.close_log()
+        # the last session is exported before the worker process is shut down
+        if len(self.export_tasks):
+            await asyncio.gather(*self.export_tasks)
+        if self.exporter is not None:
+            self.exporter.shutdown(wait=False)
+
     async def open_log(self, data):
         if 'filename' in data and len(data['filename']) > 0:
             filename = os.path.join(logger_config['path'], data['filename'])
@@ -50,12 +54,23 @@ class MQTT2Log(Component2MQTT):
             filename = os.path.join(logger_config['path'],
                                     "%s.log.csv" % datetime.now().strftime("%Y-%m-%d_%H.%M.%S"))
 
-        handle = open(filename, "w", newline="", encoding="utf-8")
-        writer = csv.DictWriter(handle, fieldnames=[f.name for f in dataclasses.fields(self.datapoint)])
-        writer.writeheader()
+        # one file per format, e.g. <name>.csv and <name>.k2s
+        base, extension = os.path.splitext(filename)
+        if extension not in SINKS:
+            base = filename
+        sinks = [FORMATS[log_format](base + FORMATS[log_format].extension) for log_format in logger_config['formats']]
+        filename = sinks[0].filename
+
+        # file IO happens on the writer thread, handlers only append to its buffer
+        self.log = LogWriter(sinks,
+                             flush_interval=logger_config['flush_interval'],
+                             fsync_interval=logger_config['fsync_interval'],
+                             capacity=logger_config['buffer_size'])
+        self.log.start()
+        self.filename = filename
+        self.fusion_task = asyncio.create_task(self.write_rows())
 
         print(f"[Logger] Log opened: {filename}")
-        self.csv = CSVWriter(filename=filename, handle=handle, writer=writer)
 
         self.log_location = 'logLocation' in data and data['logLocation']
 
@@ -64,17 +79,63 @@ class MQTT2Log(Component2MQTT):
                                                'logLocation': self.log_location})
 
     async def close_log(self):
-        if self.csv is not None:
-            self.csv.handle.close()
+        if self.log is not None:
+            self.fusion_task.cancel()
+            self.fusion_task = None
+
+            await asyncio.get_running_loop().run_in_executor(None, self.log.close)
+            if self.log.dropped > 0:
+                print(f"[Logger] Dropped {self.log.dropped} records")
 
-            print(f"[Logger] Log closed: {self.csv.filename}")
-            await self.update_mqtt("logger/data", {'status': 'closed', 'filename': self.csv.filename})
+            print(f"[Logger] Log closed: {self.filename}")
+            await self.update_mqtt("logger/data", {'status': 'closed', 'filename': self.filename})
 
-            # TODO: convert to gpx ?
+            if len(logger_config['export']) and self.log.error is None:
+                task = asyncio.create_task(self.export_log([sink.filename for sink in self.log.sinks]))
+                self.export_tasks.add(task)
+                task.add_done_callback(self.export_tasks.discard)
 
-            self.csv = None
+            self.log = None
+            self.filename = None
             self.log_location = False
 
+    async def write_rows(self):
+        # rows are aligned to the wall clock, each one written once the samples after its time have arrived
+        interval = self.fusion.interval
+        tick = (int(time.time() / interval) + 1) * interval
+        while True:
+            await asyncio.sleep(max(0.0, tick - time.time()))
+
+            timestamp = round(tick - self.fusion.delay, 3)
+            row = self.fusion.row(timestamp)
+            if row is not None:
+                record = LogRecord(timestamp)
+                for field, value in row.items():
+                    setattr(record, field, value)
+                self.log.append(record)
+
+            tick += interval
+            if tick < time.time() - interval:
+                # the event loop has been blocked, skip the missed rows
+                tick = (int(time.time() / interval) + 1) * interval
+
+    async def export_log(self, filenames):
+        # exports run in a worker process, the logger keeps handling messages
+        if self.exporter is None:
+            self.exporter = concurrent.futures.ProcessPoolExecutor(max_workers=1,
+                                                                   mp_context=multiprocessing.get_context("spawn"))
+
+        try:
+            exported = await asyncio.get_running_loop().run_in_executor(self.exporter, export_session,
+                                                                        filenames, logger_config['export'])
+        except (OSError, ValueError, struct.error, concurrent.futures.process.BrokenProcessPool) as e:
+            print(f"[Logger] Could not export log {filenames[0]}: {str(e)}")
+            await self.update_mqtt("logger/export", {'filename': filenames[0], 'error': str(e)})
+            return
+
+        print(f"[Logger] Log exported: {', '.join(exported)}")
+        await self.update_mqtt("logger/export", {'filename': filenames[0], 'exported': exported})
+
     @handle_pattern(topic_pattern="logger/cmnd/+")
     async def handle_command_messages(self, messages):
         async for message in messages:
@@ -84,66 +145,50 @@ class MQTT2Log(Component2MQTT):
                     await self.close_log()
 
                     try:
-                        data = json.loads(message.payload.decode())
+                        data = self.decode_message(message)
                         await self.open_log(data)
-                    except json.JSONDecodeError as e:
+                    except DecodeError as e:
                         await self.update_mqtt("logger/data", {'error': str(e)})
                 elif action == "stop":
                     await self.close_log()
 
-            except json.JSONDecodeError:
+            except DecodeError:
                 pass
 
-    @handle_pattern(topic_pattern="kettler/data")
+    @handle_pattern(topic_pattern="kettler/data", schema=KettlerStatus)
     async def handle_kettler_messages(self, messages):
         async for message in messages:
-            try:
-                data = json.loads(message.payload.decode())
-                if self.csv is not None:
-                    self.datapoint.timestamp = data['_timestamp']
-                    self.datapoint.speed = data['payload']['speed']
-                    self.datapoint.cadence = data['payload']['cadence']
-                    self.datapoint.power = data['payload']['realPower']
-                    self.datapoint.distance = data['payload']['calcDistance']
-
-                    if not self.log_location:
-                        self.csv.writer.writerow(dataclasses.asdict(self.datapoint))
-            except json.JSONDecodeError:
-                pass
+            status = message.payload
+            self.fusion.add('kettler', message.timestamp,
+                            (status.speed, status.cadence, status.real_power, status.calc_distance))
 
     @handle_pattern(topic_pattern="heartrate/+")
     async def handle_heartrate_messages(self, messages):
         async for message in messages:
             try:
-                data = json.loads(message.payload.decode())
+                data = self.decode_message(message)
                 if message.topic == f"{self.mqtt['base_topic']}/heartrate/connected":
-                    self.log_heartrate = data['payload']
+                    if not data['payload']:
+                        self.fusion.clear('heartrate')
                 elif message.topic == f"{self.mqtt['base_topic']}/heartrate/data":
+                    # an empty payload is published when the device disconnects
                     if 'hr' in data['payload']:
-                        self.datapoint.heart_rate = data['payload']['hr']
-
-                    if 'rri' in data['payload']:
-                        self.datapoint.rri = data['payload']['rri']
-            except json.JSONDecodeError:
+                        self.fusion.add('heartrate', data['_timestamp'],
+                                        (data['payload']['hr'], data['payload'].get('rri')))
+                    else:
+                        self.fusion.clear('heartrate')
+            except DecodeError:
                 pass
 
-    @handle_pattern(topic_pattern="controller/location")
+    @handle_pattern(topic_pattern="controller/location", schema=DistanceTrackInfo)
     async def handle_location_messages(self, messages):
         async for message in messages:
-            try:
-                data = json.loads(message.payload.decode())
-                self.datapoint.position_lat = data['payload']['latitude']
-                self.datapoint.position_long = data['payload']['longitude']
-                self.datapoint.altitude = data['payload']['elevation']
-                self.datapoint.grade = data['payload']['grade']
-
-                if self.log_location:
-                    self.csv.writer.writerow(dataclasses.asdict(self.datapoint))
-            except json.JSONDecodeError:
-                pass
+            info = message.payload
+            self.fusion.add('location', message.timestamp,
+                            (info.latitude, info.longitude, info.elevation, info.grade))
 
 async def main():
-    mqtt_server = MQTT2Log(mqtt_credentials)
+    mqtt_server = MQTT2Log(mqtt_credentials, mqtt_publish)
     await mqtt_server.mqtt_connect(will_topic="logger")
 
 def run():